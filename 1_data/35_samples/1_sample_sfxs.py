@@ -1,91 +1,59 @@
 # -*- coding: utf-8 -*-
-# Extracts candidate derivations matching the queries in to_sample.csv up to sample sizes of 100,000.
-# Saves each as its own file in raw_samples/.
-
-from SeaCOW import Query, Nonprocessor, ConcordanceLoader
+# Extracts candidate derivations matching the queries in to_sample.csv: a random sample of SAMPLE_SIZE out of the
+# first (up to) 100,000 matches for every query, drawn while the matches come in.
+# Saves each as its own file in raw_samples/ (Parquet if pyarrow is installed, otherwise CSV).
+
+from functools import partial
+import seacow_sampling as ss
+import sample_store as store
+import numpy as np
 import pandas as pd
 
 CORPUS      = 'decow16b'
+SAMPLE_SIZE = 20000     # It's way too slow to backform and test bases for 100k tokens, and we know that entropy
+                        # should stabilise upward of ~10k tokens.
+SEED        = 1         # Same seed, same samples.
 
 morph_df    = pd.read_csv('queries.csv')
 MORPHS      = morph_df['morph'].dropna()
 QUERIES     = morph_df['query'].dropna()
-NUM_MORPHS  = len(MORPHS)
 
 
 # ======================================================
 
 
-def conduct_query(cql_string, corpus):
+def prep_chunk(conc_df, morph):
   """
-  Queries the given corpus.
-  
+  Adds the compound constituents and the morpheme to a chunk of matches and rearranges the columns.
+
   Args:
-    cql_string: string in CQL format
-    corpus: string representing the corpus to query ('decow16a-nano', 'decow16b', 'encow16a', 'encow16a-nano')
-    subcorpus: string representing the subcorpus to query 
+    conc_df: pandas df with the columns in seacow_sampling.RAW_COLUMNS
+    morph: string representing the current morpheme, e.g. '-ung'
   Returns:
-    List of dicts containing the concordances, of length max_hits
+    df with the columns that are saved in 1_raw_samples/.
   """
-  
-  q = Query()
-  q.corpus          = corpus  
-  q.string          = cql_string
-  q.max_hits        = 100000
-  q.attributes      = ['word', 'lemma', 'compana']
-  q.structures      = ['s']
-  q.references      = ['doc.url', 'doc.id', 's.idx']
-  q.container       = 's'
-  q.set_deduplication()
-  
-  p                 = ConcordanceLoader()
-  p.full_structure  = True     # Convert token attributes to dicts as well, otherwise |-separated. 
-  q.processor       = p
-  q.run()
-  
-  return p.concordance
-  
-
-# ======================================================
-
-# Draw samples  from DECOW for each suffix.
-for m_idx in range(NUM_MORPHS):
-  curr_morph = MORPHS[m_idx]
-  curr_query = QUERIES[m_idx]
-
-  concs = conduct_query(curr_query, CORPUS)
-
-  # Extract the information from each match that we probably care about.
-  conc_data = [
-    {
-      'word': conc['match'][0]['word'],
-      'lemma': conc['match'][0]['lemma'],
-      'compana': conc['match'][0]['compana'],
-      'doc.id': conc['meta']['doc.id'],
-      'doc.url': conc['meta']['doc.url'],
-      's.idx': conc['meta']['s.idx']
-    } for conc in concs]
-
-  # Convert list of dicts to df.
-  conc_df = pd.DataFrame(conc_data)
 
   # Wherever 'compana' isn't '_' (i.e., wherever it's a compound), split on _ and extract first and last elements.
-  conc_df['cpd.N1'] = pd.np.where(conc_df.compana != '_',
-                                conc_df.compana.str.split("_").str[0],
-                                '')
+  conc_df['cpd.N1'] = np.where(conc_df.compana != '_',
+                             conc_df.compana.str.split("_").str[0],
+                             '')
 
-  conc_df['cpd.N2'] = pd.np.where(conc_df.compana != '_',
-                                conc_df.compana.str.split("_").str[-1],
-                                '')
+  conc_df['cpd.N2'] = np.where(conc_df.compana != '_',
+                             conc_df.compana.str.split("_").str[-1],
+                             '')
                                 
   # Add morpheme as column to df.
-  conc_df['morph'] = [curr_morph] * len(conc_df)
+  conc_df['morph'] = [morph] * len(conc_df)
 
   # Rearrange columns.
-  conc_df = conc_df[['morph', 'doc.url','doc.id','s.idx','word','lemma', 'compana', 'cpd.N1', 'cpd.N2']]
+  return conc_df[['morph', 'doc.url','doc.id','s.idx','word','lemma', 'compana', 'cpd.N1', 'cpd.N2']]
 
-  # Save as CSV.
-  conc_df.to_csv('1_raw_samples/%s.csv' % curr_morph, index=False, encoding='UTF-8')
 
-  print 'Done %s/%s: %s' % (m_idx+1, NUM_MORPHS, curr_morph)
+# ======================================================
+
+# Draw samples from DECOW for each suffix, several at a time. Suffixes that are already listed in the manifest
+# are skipped, so if some queries fail, rerunning this script only repeats those.
+JOBS = [(morph, query, '1_raw_samples/%s%s' % (morph, store.SAMPLE_EXT), partial(prep_chunk, morph=morph)) for morph, query in zip(MORPHS, QUERIES)]
+FAILED = ss.run_sampling_jobs(JOBS, CORPUS, '1_raw_samples/manifest.csv', sample_size=SAMPLE_SIZE, seed=SEED)
 
+print 'Done' if not FAILED else 'Failed: %s' % ', '.join(FAILED)
@@ -2,13 +2,19 @@
 # Count the number of times each derivation and each reconstructed base appears in the corpus.
 # To be run after 1_sample_sfxs.py.
 
-from SeaCOW import Query, Nonprocessor
 import backformer_one as b
-import pandas as pd
-import numpy as np
+import backformer_engine as engine
+import seacow_counts as sc
+from count_cache import CountCache
+from lp_index import LemmaIndex
+import sample_store as store
+import os
 
 CORPUS        = 'decow16a-nano'
-SAMPLE_SIZE   = 20000
+CACHE         = CountCache('count_cache.sqlite')   # Shared with 5_manual_query.py.
+LP_INDEX      = CORPUS + '_index'   # Built with lp_index.py from the frequency list of CORPUS; used if it exists.
+INDEX         = LemmaIndex.load(LP_INDEX) if os.path.isdir(LP_INDEX) else None
+N_PROCESSES   = engine.N_PROCESSES   # Processes for backforming (one per core).
 SFXS          = [
   '-age', '-and', '-ant', '-anz', '-ation',
   '-atur', '-ement', '-end', '-ent', '-enz',
@@ -30,65 +36,65 @@ SFXS          = [
 # ======================================================
 
 
-def get_count(cql, corpus):
+def backform_sfx(sfx):
   """
-  Counts the number of tokens for the given query in the given corpus. Returns number of hits (i.e., tokens).
+  Copies the sample of a suffix to 2_random_subsamples/ and backforms it. Runs in a worker process (see
+  backformer_engine.run_parallel()), so it only gets the suffix and reads the sample itself.
+
+  Arg:
+    sfx: string representing the suffix, e.g. '-ung'
+  Returns:
+    Tuple of sfx and the df of CQL queries for its candidate bases (see backformer_one.get_cql_from_bases()).
   """
-  
-  # Create a Query object and set whatever needs to be set.
-  q = Query()
-  q.corpus          = corpus                # Lower-case name of the corpusto use.
-  q.string          = cql                     # A normal CQL string as used in NoSketchEngine.
-  q.max_hits        = -1
-  q.attributes      = []                      # For counting, you don't need word attributes.
-  q.structures      = []                      # ... you don't need structural attributes.
-  q.references      = []                      # ... you don't need reference attrs.
-  q.container       = 's'                       # Which container structure should be used? None is OK
-                                              # only if class is Nonprocessor.
-  
-  # Using the deduplicator would NOT change the outcome. Switch off.
-  q.set_deduplication(off = True)
-  
-  # Create a Processor object and attach it to the Query object.
-  # The Nonprocessor processor does nothing. You can work with the results
-  # yourself in the finalise method or just get the hits value from the
-  # query object. It is the concordance as seported by Manatee.
-  p                 = Nonprocessor()  # Create a processor object of appropriate type.
-  q.processor       = p               # Attach the processor to the query.
-  q.run()                             # Run the query.
-  return q.hits
+
+  # Read in the sample for the current suffix (query was done in 1_sample_sfxs.py, which already drew a random
+  # sample of SAMPLE_SIZE tokens there).
+  sample_subset = store.read_sample('raw_samples/'+sfx)
+
+  # Save the current sample in random_subsamples/. This sample will form the basis of the rest of the analyses.
+  store.write_sample(sample_subset, '2_random_subsamples/' + sfx + '_subsample' + store.SAMPLE_EXT)
+
+  # Get the CQL queries for candidate bases for the current suffix via Backformer. Only the candidates that were
+  # actually generated are needed for that, once per distinct lemma (long format, see get_base_cands()).
+  curr_bases = b.get_base_cands(sample_subset, sfx)
+  return sfx, b.get_cql_from_bases(curr_bases)
 
 
 # ======================================================
 
-for sfx in SFXS:
-  
-  # Read in the sample for the current suffix (query was done in 1_sample_sfxs.py).
-  curr_sample = pd.read_csv('raw_samples/'+sfx+'.csv')#, encoding='UTF-8')
-  
-  # Take a random sample of size SAMPLE_SIZE. This will be the basis of the analysed data.
-  # (It's way too slow to backform and test bases for 100k tokens, and we know that entropy
-  # should stabilise upward of ~10k tokens.)
-  # Crashes if the size of curr_sample is < SAMPLE_SIZE, so if that happens, just take the whole sample as sample_subset.
-  try:
-    rd_idcs = np.random.choice(curr_sample.index, size = SAMPLE_SIZE, replace = False)
-    sample_subset = curr_sample.iloc[rd_idcs].reset_index(drop=True)
-  except:
-    sample_subset = curr_sample
-    
-  # Save the current sample in random_subsamples/. This sample will form the basis of the rest of the analyses.
-  sample_subset.to_csv('2_random_subsamples/' + sfx + '_subsample.csv', index=False, encoding='UTF-8')
-  
-  # Get the CQL queries for candidate bases for the current suffix via Backformer.
-  curr_bases = b.get_bases(sample_subset, sfx)
-  curr_cql_df = b.get_cql_from_bases(curr_bases)
+# First, backform every suffix, and collect the candidate tables. The suffixes don't depend on each other, so
+# they are spread over N_PROCESSES processes; the tables come back in the order of SFXS.
+CAND_TABLES = engine.run_parallel(backform_sfx, SFXS, N_PROCESSES)
+print 'Backformed', len(CAND_TABLES), 'suffixes'
+
+
+# Then plan the counts: many suffixes share candidate bases (e.g. the verbs in -ieren behind -ation, -ator,
+# -ament, ...), and some derivations occur in more than one sample, so collect every (lemma, tag) pair only once
+# over all suffixes: the candidate bases with their POS, and the derivations as NN.
+PAIRS = []
+SEEN = set()
+n_total = 0
+for sfx, cql_df in CAND_TABLES:
+  curr_pairs = list(zip(cql_df['unique_candidates'], cql_df['pos'])) + [(lemma, 'NN') for lemma in cql_df['lemma'].unique()]
+  n_total += len(curr_pairs)
+  for pair in curr_pairs:
+    if pair not in SEEN:
+      SEEN.add(pair)
+      PAIRS.append(pair)
+
+print 'Counting', len(PAIRS), 'unique lemma/tag pairs (', n_total, 'over all suffixes)'
+
+# Count all of them in one go. Rather than one query per pair, this sends one query per POS tag and batch of
+# lemmas and splits the hits up by lemma (see seacow_counts.py). Pairs that are in INDEX aren't queried at all.
+FREQS = dict(zip(PAIRS, sc.get_counts_batched(PAIRS, CORPUS, cache=CACHE, index=INDEX)))
+
 
-  # Conduct queries and add as new column to curr_cql_df.
-  curr_cql_df['base_freq'] = [get_count(query, CORPUS) for query in curr_cql_df['cql']]
+# Finally, join the counts back to each suffix's candidate table.
+for sfx, curr_cql_df in CAND_TABLES:
 
-  # Get frequencies of derivations too (uniquify them and then merge freqs with curr_cql_df).
-  lemma_freqs = [{'lemma':lemma, 'lemma_freq':get_count('[lemma="%s" & tag="NN"] within <s/>' % lemma, CORPUS)} for lemma in curr_cql_df['lemma'].unique()]
-  curr_cql_df = curr_cql_df.merge( pd.DataFrame(lemma_freqs), on='lemma' )
+  # Add the base frequencies and the lemma frequencies as new columns.
+  curr_cql_df['base_freq'] = [FREQS[pair] for pair in zip(curr_cql_df['unique_candidates'], curr_cql_df['pos'])]
+  curr_cql_df['lemma_freq'] = [FREQS[(lemma, 'NN')] for lemma in curr_cql_df['lemma']]
 
   # Reorder columns (and drop CQL, don't need it anymore) and save to CSV.
   curr_cql_df = curr_cql_df[['lemma', 'unique_candidates', 'pos', 'lemma_freq', 'base_freq']]
@@ -96,3 +102,5 @@ for sfx in SFXS:
 
   print 'Done', sfx
 
+print 'Cache:', CACHE.stats()
+CACHE.close()
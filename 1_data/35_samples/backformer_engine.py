@@ -0,0 +1,892 @@
+# -*- coding: utf-8 -*-
+# Vectorised engine for Backformer. Instead of looping over the lemmas in Python like the get_X_bases() functions,
+# it takes a rule set (see below) and computes every candidate column for all lemmas at once with pandas string
+# methods. The rule sets themselves live in backformer_one.py and ../../3_validity/variables/backformer_two.py;
+# compile_dispatch() compiles them once and looks up which one each suffix uses in queries.csv, so a new suffix
+# only needs a row there (and a new kind of rule only a new rule set). SuffixRouter finds the suffix of lemmas
+# that don't come sorted by suffix.
+#
+# A rule set is a dict with the keys:
+#   'vars':    list of (name, source, ops) tuples, evaluated in order. Each one applies the ops to the variable
+#              source ('lemma' to start with) and saves the result under name (which may overwrite an earlier one).
+#   'when':    optional list of conditions that apply to all candidates (if one fails, all candidates are '').
+#   'exclude': optional set of lemmas whose rows are dropped before backforming.
+#   'cands':   list of (column, var, ops, conditions) or (column, var, ops, conditions, else_ops) tuples, one for
+#              every base_candN_POS column, in the order in which the columns are created. The candidate is the
+#              variable var with ops applied if all conditions hold; otherwise else_ops applied to var, or ''.
+#
+# Ops are tuples of a name and its arguments:
+#   ('strip', n)                   remove the last n characters (like lemma[:-n])
+#   ('strip_sfx',)                 remove as many characters as the suffix has, without its hyphen
+#   ('lower',)                     lower-case and fix umlauts, like .lower().replace('Ü', 'ü')...
+#   ('lowercase',), ('fix_umlauts',)   the two halves of 'lower'
+#   ('nouml',)                     replace ü, ä, ö with u, a, o
+#   ('cap',)                       capitalise (like str.capitalize())
+#                                  ('lower', 'nouml', and 'cap' are looked up in NORMS, see NormTable)
+#   ('add', s)                     append s
+#   ('replace', old, new)          replace every old with new
+#   ('irreg', pairs)               replace every key with its value, one (key, value) pair after the other
+#   ('irreg_whole', pairs)         replace the whole string if it equals a key
+#   ('map', dict)                  look the string up in dict ('' if it isn't there)
+#   ('strip_if_endswith', s, n)    remove the last n characters if the string ends in s
+#   ('after_hyphen',)              if the string contains -, take the part after the first one
+#
+# Conditions are (var, test) or (var, test, arg) tuples; prefix a test with 'not_' to negate it:
+#   'endswith', 'startswith' (arg: string or tuple of strings, any of which may match), 'contains' (arg: string),
+#   'has_umlaut', 'isin' (arg: set), 'longer' (arg: n, true if the string has more than n characters),
+#   'char' (arg: (position, character), e.g. (-4, 'h') for lemma[-4] == 'h').
+
+import itertools
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from lp_index import _literal_tail, compile_cql_regex, parse_lemma_query
+from process_pool import N_PROCESSES, run_parallel   # Also used as engine.run_parallel() by the scripts.
+
+_intern = getattr(sys, 'intern', None) or intern   # Built-in in Python 2.
+
+UMLAUTS     = ['ä', 'ö', 'ü']
+FIX_UMLAUTS = [('Ü', 'ü'), ('Ä', 'ä'), ('Ö', 'ö')]
+NO_UMLAUTS  = [('ü', 'u'), ('ä', 'a'), ('ö', 'o')]
+QUERIES     = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries.csv')
+CACHE_SIZE  = 100000   # Number of (rule set, suffix, lemma) entries kept in CACHE.
+NORMS_SIZE  = 1000000  # Number of normalised forms kept in NORMS before it is emptied.
+
+
+# ======================================================
+
+
+class LRUCache(object):
+    """
+    Dict-like cache that holds at most max_size entries; when it is full, the least recently used entry is dropped.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.n_hits = 0
+        self.n_misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the entry for key (and marks it as most recently used), or None if there isn't one.
+        """
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.n_misses += 1
+            return None
+        self._entries[key] = value
+        self.n_hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """
+        Returns a dict with the number of hits and misses so far and the number of entries.
+        """
+        return {'hits': self.n_hits, 'misses': self.n_misses, 'entries': len(self._entries)}
+
+
+def _take(values, codes, missing):
+    """
+    Picks values[code] for every code from pd.factorize(), and missing where the code is -1 (missing input).
+    """
+    out = np.empty(len(codes), dtype=values.dtype)
+    found = codes != -1
+    out[found] = values[codes[found]]
+    out[~found] = missing
+    return out
+
+
+class NormTable(object):
+    """
+    Table of the normalised forms of strings (lemmas, and the stems and candidates made from them): lower-cased
+    with fixed umlauts ('lower'), without umlauts ('nouml'), capitalised ('cap'), and whether it contains an umlaut
+    ('has_umlaut'). Each form of a distinct string is computed only once, the first time it is looked up, however
+    many tokens, rule sets, and suffixes share it; strings are interned, so that equal ones are only stored once.
+    A form's table is emptied when it would grow beyond max_size entries, so that memory stays bounded however
+    many distinct strings are looked up (e.g. when streaming all of DErivBase through Backformer).
+    """
+
+    FORMS = ['lower', 'nouml', 'cap', 'has_umlaut']
+
+    def __init__(self, max_size=NORMS_SIZE):
+        self.max_size = max_size
+        self._forms = dict((form, {}) for form in self.FORMS)   # form -> {string: normalised form}
+
+    def _normalise(self, s, form):
+        if form == 'has_umlaut':
+            return s.str.contains('|'.join(UMLAUTS)).values.astype(bool).tolist()
+        if form == 'lower':
+            s = _replace_all(s.str.lower(), FIX_UMLAUTS)
+        elif form == 'nouml':
+            s = _replace_all(s, NO_UMLAUTS)
+        else:
+            s = s.str.capitalize()
+        return [_intern(x) for x in s]
+
+    def lookup(self, strings, form):
+        """
+        Returns one of the normalised forms (see FORMS) of a Series of strings as a Series with the same index
+        (as a boolean numpy array for 'has_umlaut'). Strings that don't have that form in the table yet are
+        normalised together and added. Missing values stay NaN (False for 'has_umlaut').
+        """
+        strings = pd.Series(strings)
+        codes, uniques = pd.factorize(strings)
+        table = self._forms[form]
+        missing = [_intern(string) for string in uniques if string not in table]
+        if missing:
+            if len(table) + len(missing) > self.max_size:
+                table.clear()
+                missing = [_intern(string) for string in uniques]
+            table.update(zip(missing, self._normalise(pd.Series(missing, dtype=object), form)))
+        values = np.array([table[string] for string in uniques], dtype=bool if form == 'has_umlaut' else object)
+        if form == 'has_umlaut':
+            return _take(values, codes, False)
+        return pd.Series(_take(values, codes, np.nan), index=strings.index)
+
+    def __len__(self):
+        return sum(len(table) for table in self._forms.values())
+
+    def clear(self):
+        for table in self._forms.values():
+            table.clear()
+
+
+CACHE = LRUCache(CACHE_SIZE)   # Shared by all compiled rule sets (both Backformer versions, all suffixes).
+NORMS = NormTable(NORMS_SIZE)  # Likewise.
+_uids = itertools.count()
+
+
+# ======================================================
+
+
+def _compile_op(op):
+    """
+    Turns one op into a function of a pandas Series of strings and the suffix.
+    """
+    name = op[0]
+
+    if name == 'strip':
+        n = op[1]
+        return lambda s, sfx: s.str[:-n]
+    if name == 'strip_sfx':
+        return lambda s, sfx: s.str[:-(len(sfx) - 1)]
+    if name == 'lowercase':
+        return lambda s, sfx: s.str.lower()
+    if name == 'fix_umlauts':
+        return lambda s, sfx: _replace_all(s, FIX_UMLAUTS)
+    if name in ('lower', 'nouml', 'cap'):
+        return lambda s, sfx: NORMS.lookup(s, name)
+    if name == 'add':
+        ending = op[1]
+        return lambda s, sfx: s + ending
+    if name == 'replace':
+        pairs = [(op[1], op[2])]
+        return lambda s, sfx: _replace_all(s, pairs)
+    if name == 'irreg':
+        pairs = list(op[1])
+        return lambda s, sfx: _replace_all(s, pairs)
+    if name == 'irreg_whole':
+        pairs = list(op[1])
+        def irreg_whole(s, sfx):
+            for key, val in pairs:
+                s = s.where(s != key, val)
+            return s
+        return irreg_whole
+    if name == 'map':
+        mapping = op[1]
+        return lambda s, sfx: s.map(mapping).fillna('')
+    if name == 'strip_if_endswith':
+        end, n = op[1], op[2]
+        return lambda s, sfx: s.where(~s.str.endswith(end), s.str[:-n])
+    if name == 'after_hyphen':
+        def after_hyphen(s, sfx):
+            parts = s.str.split('-')
+            return s.where(parts.str.len() <= 1, parts.str[1])
+        return after_hyphen
+
+    raise ValueError('Unknown op: %s' % name)
+
+
+def _replace_all(s, pairs):
+    """
+    Replaces every old string with its new one, one pair after the other.
+    """
+    for old, new in pairs:
+        s = s.str.replace(old, new, regex=False)
+    return s
+
+
+def _compile_test(test, arg):
+    """
+    Turns one condition into a function of a pandas Series of strings that returns a boolean numpy array.
+    """
+    if test.startswith('not_'):
+        positive = _compile_test(test[4:], arg)
+        return lambda s: ~positive(s)
+
+    if test in ('endswith', 'startswith'):
+        pats = arg if isinstance(arg, tuple) else (arg,)
+        def affix(s):
+            mask = np.zeros(len(s), dtype=bool)
+            for pat in pats:
+                mask |= getattr(s.str, test)(pat).values.astype(bool)
+            return mask
+        return affix
+    if test == 'contains':
+        return lambda s: s.str.contains(arg, regex=False).values.astype(bool)
+    if test == 'has_umlaut':
+        return lambda s: NORMS.lookup(s, 'has_umlaut')
+    if test == 'isin':
+        return lambda s: s.isin(arg).values
+    if test == 'longer':
+        return lambda s: (s.str.len() > arg).values
+    if test == 'char':
+        pos, char = arg
+        return lambda s: (s.str.get(pos) == char).values
+
+    raise ValueError('Unknown test: %s' % test)
+
+
+class CompiledRuleSet(object):
+    """
+    A rule set compiled into a list of steps that are evaluated in one pass: every variable, every intermediate
+    result of the candidates' ops, and every condition is only computed once, however many candidates share it
+    (e.g. stem[:-1] for all the -eln, -en, and -e candidates of -er, or stem ending in 'l' for five of them).
+    Call it with a df to backform it, or use lemma_table() or long_table() to get the candidates of every distinct
+    lemma only, or match() to look up given pairs of derivation and base among them.
+    """
+
+    def __init__(self, rule_set):
+        self.uid = next(_uids)   # Distinguishes this rule set's entries in a cache shared by all of them.
+        self.exclude = rule_set.get('exclude')
+        self.steps = []   # (node, parent node, function) for every string result; node 0 is the lemma.
+        self.tests = []   # (node, function) for every condition.
+        self._nodes = {}
+        self._test_ids = {}
+
+        variables = {'lemma': 0}
+        for name, source, ops in rule_set['vars']:
+            variables[name] = self._chain(variables[source], ops)
+
+        guard = self._conditions(variables, rule_set.get('when', []))
+
+        self.cands = []   # (column, value node, condition ids, else node or None, guard condition ids)
+        for cand in rule_set['cands']:
+            col, var, ops, conditions = cand[:4]
+            else_ops = cand[4] if len(cand) > 4 else None
+            self.cands.append((col, self._chain(variables[var], ops), self._conditions(variables, conditions),
+                               self._chain(variables[var], else_ops) if else_ops is not None else None, guard))
+        self.columns = []
+        for cand in self.cands:
+            if cand[0] not in self.columns:
+                self.columns.append(cand[0])
+        self.pos = [col.split('_')[-1] for col in self.columns]
+
+    def _chain(self, node, ops):
+        for op in ops:
+            key = (node, repr(op))
+            if key not in self._nodes:
+                self._nodes[key] = len(self._nodes) + 1
+                self.steps.append((self._nodes[key], node, _compile_op(op)))
+            node = self._nodes[key]
+        return node
+
+    def _conditions(self, variables, conditions):
+        ids = []
+        for cond in conditions:
+            var, test, arg = cond if len(cond) == 3 else (cond[0], cond[1], None)
+            key = (variables[var], test, repr(arg))
+            if key not in self._test_ids:
+                self._test_ids[key] = len(self.tests)
+                self.tests.append((variables[var], _compile_test(test, arg)))
+            ids.append(self._test_ids[key])
+        return tuple(ids)
+
+    def _evaluate(self, lemmas, sfx):
+        """
+        Computes the candidates for a Series of lemmas. Returns a dict mapping every column to a numpy array (a
+        later candidate with the same column name replaces the earlier one, as in the get_X_bases() functions).
+        """
+        results = {0: lemmas}
+        for node, parent, fn in self.steps:
+            results[node] = fn(results[parent], sfx)
+        test_results = [fn(results[node]) for node, fn in self.tests]
+
+        masks = {}
+        def mask(cond_ids):
+            if cond_ids not in masks:
+                masks[cond_ids] = np.logical_and.reduce([test_results[idx] for idx in cond_ids])
+            return masks[cond_ids]
+
+        columns = {}
+        for col, node, cond_ids, else_node, guard in self.cands:
+            values = results[node]
+            if cond_ids:
+                values = values.where(mask(cond_ids), results[else_node] if else_node is not None else '')
+            if guard:
+                values = values.where(mask(guard), '')
+            columns[col] = np.asarray(values, dtype=object)
+        return columns
+
+    def _sparse(self, columns, n):
+        """
+        Turns the output of _evaluate() for n lemmas into one tuple per lemma of (column index, candidate) pairs,
+        leaving out the empty candidates.
+        """
+        rows = [[] for _ in range(n)]
+        for col_idx, col in enumerate(self.columns):
+            values = columns[col]
+            for idx in np.flatnonzero(values != ''):
+                rows[idx].append((col_idx, values[idx]))
+        return [tuple(row) for row in rows]
+
+    def _lemma_cands(self, lemmas, sfx, cache):
+        """
+        Backforms every distinct lemma only once. The candidates of each lemma are kept in cache, so that lemmas
+        that were already backformed (with this rule set and suffix) in an earlier call aren't computed again.
+
+        Returns:
+            Tuple of the list of distinct lemmas (in order of first appearance; lemmas in the rule set's 'exclude'
+            are dropped) and the list of their candidates as (column index, candidate) pairs (see _sparse()).
+        """
+        uniques = pd.unique(pd.Series(lemmas)).tolist()
+        if self.exclude:
+            uniques = [lemma for lemma in uniques if lemma not in self.exclude]
+
+        if cache is None:
+            return uniques, self._sparse(self._evaluate(pd.Series(uniques, dtype=object), sfx), len(uniques))
+
+        rows = [cache.get((self.uid, sfx, lemma)) for lemma in uniques]
+        missing = [lemma for lemma, row in zip(uniques, rows) if row is None]
+        if missing:
+            new_rows = self._sparse(self._evaluate(pd.Series(missing, dtype=object), sfx), len(missing))
+            for lemma, row in zip(missing, new_rows):
+                cache.put((self.uid, sfx, lemma), row)
+            new_rows = iter(new_rows)
+            rows = [row if row is not None else next(new_rows) for row in rows]
+        return uniques, rows
+
+    def lemma_table(self, lemmas, sfx=None, cache=CACHE):
+        """
+        Backforms every distinct lemma once (see _lemma_cands()).
+
+        Args:
+            lemmas: list or Series of lemmas, with repetitions (e.g. column 'lemma' of a sample)
+            sfx: string representing the suffix, e.g. '-and'
+            cache: LRUCache, or None to not cache anything
+        Returns:
+            df with one row per distinct lemma (in order of first appearance; lemmas in the rule set's 'exclude' are
+            dropped): column 'lemma' and one column per candidate ('' where there is none).
+        """
+        uniques, rows = self._lemma_cands(lemmas, sfx, cache)
+        columns = [np.full(len(uniques), '', dtype=object) for _ in self.columns]
+        for idx, row in enumerate(rows):
+            for col_idx, cand in row:
+                columns[col_idx][idx] = cand
+
+        table = pd.DataFrame(dict(zip(self.columns, columns)), columns=self.columns)
+        table.insert(0, 'lemma', uniques)
+        return table
+
+    def long_table(self, lemmas, sfx=None, cache=CACHE):
+        """
+        Backforms every distinct lemma once (see _lemma_cands()) and lists only the candidates that were generated,
+        one per row.
+
+        Args:
+            lemmas: list or Series of lemmas, with repetitions (e.g. column 'lemma' of a sample)
+            sfx: string representing the suffix, e.g. '-and'
+            cache: LRUCache, or None to not cache anything
+        Returns:
+            df with the columns lemma, candidate, pos, and rule_id (the name of the base_candN_POS column the
+            get_X_bases() function would have put the candidate in), sorted like the columns and then like the
+            lemmas, i.e. in the same order as pd.melt() of the wide table without the empty candidates.
+        """
+        uniques, rows = self._lemma_cands(lemmas, sfx, cache)
+        col_idcs, lemma_idcs, cands = [], [], []
+        for idx, row in enumerate(rows):
+            for col_idx, cand in row:
+                col_idcs.append(col_idx)
+                lemma_idcs.append(idx)
+                cands.append(cand)
+
+        order = np.argsort(np.array(col_idcs, dtype=int), kind='mergesort')
+        col_idcs = np.array(col_idcs, dtype=int)[order]
+        return pd.DataFrame({'lemma': np.array(uniques, dtype=object)[np.array(lemma_idcs, dtype=int)[order]]
+                                      if uniques else np.array([], dtype=object),
+                             'candidate': np.array(cands, dtype=object)[order],
+                             'pos': np.array(self.pos, dtype=object)[col_idcs],
+                             'rule_id': np.array(self.columns, dtype=object)[col_idcs]},
+                            columns=['lemma', 'candidate', 'pos', 'rule_id'])
+
+    def match(self, pairs, sfx=None, other='other', cache=CACHE):
+        """
+        Selects the pairs of a derivation and another word in which the other word is one of the derivation's
+        candidates. The candidates of every distinct lemma are generated once (see long_table()) and looked up
+        with a hash join, instead of testing every pair against a row of all candidate columns.
+
+        Args:
+            pairs: df with the derivations in column 'lemma' and the words to look for in column other
+            sfx: string representing the suffix, e.g. '-and'
+            other: name of the column with the other words
+            cache: LRUCache, or None to not cache anything
+        Returns:
+            df of the rows of pairs whose other word is a candidate (in their original order and with their index),
+            with the new column rule_id: the name of the first base_candN_POS column that holds it.
+        """
+        cands = self.long_table(pairs['lemma'], sfx, cache).drop_duplicates(['lemma', 'candidate'])
+        keys = pd.MultiIndex.from_arrays([cands['lemma'].values, cands['candidate'].values])
+        rows = keys.get_indexer(pd.MultiIndex.from_arrays([pairs['lemma'].values, pairs[other].values]))
+
+        matched = pairs[rows >= 0].copy()
+        matched['rule_id'] = cands['rule_id'].values[rows[rows >= 0]]
+        return matched
+
+    def __call__(self, df_in, sfx=None, cache=CACHE):
+        """
+        Backforms the lemmas of a df like the get_X_bases() functions: one candidate column per row (token), but
+        computed only once per distinct lemma (see lemma_table()). df_in isn't changed, and its other columns are
+        only copied once, into the result.
+        """
+        df = df_in[~df_in['lemma'].isin(self.exclude)] if self.exclude else df_in
+
+        table = self.lemma_table(df['lemma'], sfx, cache)
+        rows = pd.Index(table['lemma']).get_indexer(df['lemma'])
+        cands = pd.DataFrame(dict((col, table[col].values[rows]) for col in self.columns), index=df.index,
+                             columns=self.columns)
+        if any(col in df.columns for col in self.columns):   # Backformed before: replace the old candidates.
+            df = df.copy()
+            for col in self.columns:
+                df[col] = cands[col]
+            return df
+        return pd.concat([df, cands], axis=1)
+
+
+def backform(df_in, rule_set, sfx=None):
+    """
+    Backforms the contents of column 'lemma' according to a rule set and saves the candidates as new columns,
+    exactly like the get_X_bases() function the rule set was written for.
+
+    Args:
+        df_in: dataframe containing derivation tokens in column 'lemma'
+        rule_set: dict as described at the top of this file
+        sfx: string representing the suffix, e.g. '-and' (only needed by rule sets that use 'strip_sfx')
+    Returns:
+        df with new columns containing potential bases
+    """
+    return CompiledRuleSet(rule_set)(df_in, sfx)
+
+
+def rule_set_names(fn_column, queries_path=QUERIES):
+    """
+    Reads which rule set queries.csv names for each suffix.
+
+    Args:
+        fn_column: column of queries.csv with the names, 'fn_backformer_one' or 'fn_backformer_two'
+        queries_path: path of queries.csv
+    Returns:
+        Dict mapping every suffix in column 'morph' (e.g. '-ung'; '-ität' also as '-itaet', the spelling used in
+        file names) to the name of its rule set.
+    """
+    queries = pd.read_csv(queries_path).dropna(subset=['morph'])
+    names = {}
+    for morph, name in zip(queries['morph'], queries[fn_column]):
+        names[morph] = name
+        names[morph.replace('ä', 'ae')] = name
+    return names
+
+
+def compile_dispatch(rule_sets, fn_column, queries_path=QUERIES):
+    """
+    Compiles every rule set once and maps every suffix in queries.csv to the one named in its row.
+
+    Args:
+        rule_sets: dict mapping names to rule sets, e.g. backformer_one.RULE_SETS
+        fn_column: column of queries.csv with the names, 'fn_backformer_one' or 'fn_backformer_two'
+        queries_path: path of queries.csv
+    Returns:
+        Dict mapping suffixes (as in rule_set_names()) to CompiledRuleSets.
+    """
+    compiled = dict((name, CompiledRuleSet(rule_set)) for name, rule_set in rule_sets.items())
+    dispatch = {}
+    for sfx, name in rule_set_names(fn_column, queries_path).items():
+        if name not in compiled:
+            raise ValueError('No rule set called %s (for %s in %s)' % (name, sfx, queries_path))
+        dispatch[sfx] = compiled[name]
+    return dispatch
+
+
+class SuffixRouter(object):
+    """
+    Sorts lemmas of any suffix (e.g. a whole frequency list) by the suffix query in queries.csv that matches them,
+    so that they can be backformed with that suffix's rule set. The literal ends of the queries' lemma regexes
+    (e.g. 'ung', 'iker', 'er', 'eit' for '(h|k)eit') are stored reversed in a trie; a lemma is looked up in it from
+    its last character on, and the suffixes found on the way are tried from the longest to the shortest: the first
+    one whose whole query matches (lookbehinds and lemma!= exclusions included) is the lemma's suffix. So
+    'Techniker' is -iker rather than -er, and 'Lage' (excluded from -age, and not matched by -e) is none.
+    Ambiguous lemmas like 'Studie|Studium', which prep_sfx_df() drops, don't get a suffix either.
+    """
+
+    def __init__(self, queries_path=QUERIES):
+        self._trie = {}
+        queries = pd.read_csv(queries_path).dropna(subset=['morph', 'query'])
+        for morph, cql in zip(queries['morph'], queries['query']):
+            lemma_regex, exclusions, tag = parse_lemma_query(cql)
+            node = self._trie
+            for char in reversed(_literal_tail(lemma_regex)):
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append((morph, compile_cql_regex(lemma_regex),
+                                              [compile_cql_regex(exclusion) for exclusion in exclusions]))
+        self.morphs = queries['morph'].tolist()
+
+    def route_one(self, lemma):
+        """
+        Returns the suffix (as in column morph of queries.csv, e.g. '-ung') whose query matches lemma, or '' if
+        there is none.
+        """
+        if '|' in lemma:
+            return ''
+
+        found = []
+        node = self._trie
+        for char in reversed(lemma):
+            node = node.get(char)
+            if node is None:
+                break
+            found.extend(node.get(None, []))
+
+        for morph, pattern, excluded in reversed(found):   # Longest suffix first.
+            if pattern.match(lemma) and not any(ex.match(lemma) for ex in excluded):
+                return morph
+        return ''
+
+    def route(self, lemmas):
+        """
+        Looks up the suffix of every lemma (see route_one()), each distinct lemma only once.
+
+        Returns:
+            numpy array with the suffix of every lemma ('' where there is none).
+        """
+        codes, uniques = pd.factorize(pd.Series(lemmas))
+        morphs = np.array([self.route_one(lemma) for lemma in uniques], dtype=object)
+        return _take(morphs, codes, '')
+
+
+# ======================================================
+# Frontend shared by both Backformer versions: the cleanup of the samples, and the get_bases() etc. functions of
+# backformer_one.py and ../../3_validity/variables/backformer_two.py, which are the methods of a Backformer made
+# from each module's rule sets.
+
+
+def prep_sfx_lemmas(df_raw):
+    """
+    Same cleanup as prep_sfx_df(), but only of the lemmas: nothing else in df_raw is copied, so this is all that
+    backforming needs (see Backformer.get_base_cands()).
+
+    Arg:
+        df_raw: pandas df containing lemma and cpd.N2 columns, straight out of SeaCOW (e.g. read in with only these
+          two columns)
+    Returns:
+        pandas Series of the cleaned-up lemmas, with the positions in df_raw of the rows that are kept as index.
+    """
+    lemmas = pd.Series(np.where(df_raw['cpd.N2'].isnull(),
+                                df_raw['lemma'],
+                                df_raw['cpd.N2']), dtype=object)
+    lemmas = pd.Series(np.where(lemmas.str.contains('-'),
+                                lemmas.str.split('-').str[-1],
+                                lemmas), dtype=object)
+    return lemmas[~lemmas.str.contains('|', regex=False)]
+
+
+def prep_sfx_df(df_raw):
+    """
+    If there are compounds in the data, then replace the value of 'lemma' with the compound head, in 'cpd.N2'.
+    If lemma contains -, split at - and take final element (also the head).
+    Drop any rows where the lemma contains |; this is a case of ambiguous lemmatisation.
+
+    Arg:
+        df_raw: pandas df containing lemma, compana, cpd.N1, cpd.N2 columns, straight out of SeaCOW
+    Returns:
+        df with cpd.N2 integrated into lemma and cols compana and cpd.N1 dropped.
+    """
+    lemmas = prep_sfx_lemmas(df_raw)
+    columns = [idx for idx, col in enumerate(df_raw.columns) if col not in ['compana', 'cpd.N1', 'cpd.N2']]
+    df_in = df_raw.iloc[lemmas.index.values, columns].reset_index(drop=True)
+    df_in['lemma'] = lemmas.values
+    return df_in
+
+
+class Backformer(object):
+    """
+    One version of Backformer: its rule sets, compiled for the suffixes in queries.csv (see compile_dispatch()),
+    and the functions that backform samples with them. The get_X_bases() functions of the version are kept as the
+    reference that the rule sets are checked against (see get_bases_legacy() and check_engine()); they are looked
+    up by name in legacy, e.g. the globals() of backformer_one.py.
+    """
+
+    def __init__(self, rule_sets, fn_column, legacy=None, queries_path=QUERIES):
+        self.fn_column = fn_column
+        self.dispatch = compile_dispatch(rule_sets, fn_column, queries_path)
+        self.sfx_rule_sets = rule_set_names(fn_column, queries_path)
+        self.legacy = legacy if legacy is not None else {}
+        self.queries_path = queries_path
+        self._router = None
+
+    @property
+    def router(self):
+        """
+        SuffixRouter for the queries in queries.csv, made the first time it is needed.
+        """
+        if self._router is None:
+            self._router = SuffixRouter(self.queries_path)
+        return self._router
+
+    def rule_set(self, sfx):
+        """
+        Returns the CompiledRuleSet of a suffix, or raises a ValueError if queries.csv doesn't have the suffix.
+        """
+        if sfx not in self.dispatch:
+            raise ValueError('Invalid suffix: %s. Please enter one of the following forms: %s' % (sfx, str(set(self.dispatch))))
+        return self.dispatch[sfx]
+
+    def get_bases(self, df_raw, sfx, tokens=True):
+        """
+        Frontend function that backforms the lemmas with the rule set that queries.csv names for the suffix passed in.
+
+        Args:
+            df_raw: dataframe containing derivations in column 'lemma', read in from file.
+            sfx: string representing the suffix (must be in predetermined list of suffixes)
+            tokens: if False, return only one row per distinct lemma (columns lemma and base_cand*), which is enough
+              for get_unique_base_cands() and avoids copying the candidates to every token of the same lemma.
+        Returns:
+            pandas df containing original data along with the generated bases for the given data and sfx.
+        """
+        # Clean up the data using prep_sfx_df() (only the lemmas if tokens is False, see prep_sfx_lemmas()), then
+        # apply the suffix's compiled rule set. Either way, every distinct lemma is only backformed once (and not at
+        # all if it's still in CACHE from an earlier call).
+        if not tokens:
+            return self.rule_set(sfx).lemma_table(prep_sfx_lemmas(df_raw), sfx)
+        return self.rule_set(sfx)(prep_sfx_df(df_raw), sfx)
+
+    def get_bases_no_cleanup(self, df, sfx):
+        """
+        Same as get_bases(), but doesn't call the cleanup function for the raw corpus data (used for the semantic
+        relatedness scores from DErivBase).
+        """
+        return self.rule_set(sfx)(df, sfx)
+
+    def get_base_cands(self, df_raw, sfx):
+        """
+        Like get_bases(), but returns the candidates in long format: one row per distinct lemma and candidate it
+        generated, without the empty candidates (so the size of the result depends on the number of real
+        candidates, not on the number of rows times the number of rules).
+
+        Args:
+            df_raw: dataframe containing derivations in column 'lemma', read in from file.
+            sfx: string representing the suffix (must be in predetermined list of suffixes)
+        Returns:
+            pandas df with the columns lemma, candidate, pos, and rule_id (the base_candN_POS column that
+            get_bases() puts the candidate in).
+        """
+        return self.rule_set(sfx).long_table(prep_sfx_lemmas(df_raw), sfx)
+
+    def get_base_cands_routed(self, df_raw, router=None):
+        """
+        Like get_base_cands(), but for lemmas with any suffix, e.g. a whole frequency list: every lemma is routed to
+        the suffix whose query in queries.csv matches it (see SuffixRouter) and backformed with that suffix's rule
+        set, so that all suffixes can be backformed from one input.
+
+        Args:
+            df_raw: dataframe containing derivations in column 'lemma', either read in from file (with the columns
+              compana, cpd.N1, and cpd.N2, see prep_sfx_df()) or just lemmas.
+            router: SuffixRouter (default: self.router)
+        Returns:
+            pandas df with the columns morph, lemma, candidate, pos, and rule_id (see get_base_cands()). Lemmas
+            that no query matches are left out.
+        """
+        morphs = (router or self.router).route(df_raw['lemma'])
+        lemmas = prep_sfx_lemmas(df_raw) if 'cpd.N2' in df_raw.columns else pd.Series(df_raw['lemma'].values, dtype=object)
+        df = pd.DataFrame({'morph': morphs[lemmas.index.values], 'lemma': lemmas.values})
+        df = df[df['morph'] != '']
+
+        tables = []
+        for sfx, group in df.groupby('morph', sort=False):
+            table = self.dispatch[sfx].long_table(group['lemma'], sfx)
+            table.insert(0, 'morph', sfx)
+            tables.append(table)
+        if not tables:
+            return pd.DataFrame(columns=['morph', 'lemma', 'candidate', 'pos', 'rule_id'])
+        return pd.concat(tables, ignore_index=True)
+
+    def match_bases(self, pairs_df, sfx, other='other'):
+        """
+        Selects the pairs of derivation and other word (e.g. from DErivBase) in which Backformer generates the
+        other word as a candidate base of the derivation. Same result as get_bases_no_cleanup() followed by checking
+        every row's candidates, but each distinct lemma is backformed once and the pairs are looked up among its
+        candidates with a hash join (see CompiledRuleSet.match()).
+
+        Args:
+            pairs_df: dataframe containing derivations in column 'lemma' and the potential bases in column other.
+            sfx: string representing the suffix (must be in predetermined list of suffixes)
+            other: name of the column with the potential bases
+        Returns:
+            pandas df containing the matching rows of pairs_df, with the new column rule_id (the base_candN_POS
+            column that get_bases_no_cleanup() puts the base in).
+        """
+        return self.rule_set(sfx).match(pairs_df, sfx, other)
+
+    def match_bases_chunked(self, chunks, jobs, other='other'):
+        """
+        Chunked version of match_bases() for pairs that are read in blocks, e.g. with pd.read_csv(..., chunksize=n)
+        from the whole DErivBase lexicon: only one block is in memory and backformed at a time, and only the
+        matching pairs are kept, so memory use doesn't grow with the size of the lexicon. Every block is read only
+        once for all jobs.
+
+        Args:
+            chunks: iterable of dataframes
+            jobs: dict mapping keys (e.g. suffixes) to (sfx, select) tuples, where select is a function that turns
+                a block into a pairs_df for match_bases() (e.g. the rows with derivations in sfx), or None to use
+                the block as it is.
+            other: name of the column with the potential bases
+        Returns:
+            Dict mapping every key of jobs to a pandas df of all its matching pairs, in the order they were read.
+            A key without any matches gets an empty df with the same columns as match_bases() returns.
+        """
+        for sfx, select in jobs.values():
+            self.rule_set(sfx)
+
+        matched = dict((key, []) for key in jobs)
+        for chunk in chunks:
+            for key, (sfx, select) in jobs.items():
+                pairs_df = select(chunk) if select is not None else chunk
+                matched[key].append(self.match_bases(pairs_df, sfx, other))
+
+        # Without any blocks there is nothing to take the columns from, so fall back on the ones match_bases() needs.
+        return dict((key, pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=['lemma', other, 'rule_id']))
+                    for key, dfs in matched.items())
+
+    def get_bases_legacy(self, df_raw, sfx):
+        """
+        Same as get_bases(), but with the get_X_bases() functions instead of the rule sets, which are checked
+        against them (see check_engine()).
+        """
+        name = self.sfx_rule_sets[sfx]
+        prep = self.legacy.get('prep_sfx_df', prep_sfx_df)
+        if name == 'w_ieren':
+            return self.legacy['get_bases_w_ieren'](prep(df_raw), sfx)
+        fn = self.legacy['get_itaet_bases' if name == 'ität' else 'get_%s_bases' % name]
+        return fn(prep(df_raw))
+
+    def check_engine(self, df_raw, sfx):
+        """
+        Checks that get_bases() gives the same result as get_bases_legacy(), and that get_bases(..., tokens=False)
+        and get_base_cands() give the same unique candidates (see get_unique_base_cands() in legacy).
+
+        Returns:
+            Dict of the columns that differ and in how many rows (see compare()); empty if none do.
+        """
+        get_unique_base_cands = self.legacy['get_unique_base_cands']
+        legacy = self.get_bases_legacy(df_raw, sfx)
+        diffs = compare(legacy, self.get_bases(df_raw, sfx))
+        legacy_unique = get_unique_base_cands(legacy).reset_index(drop=True)
+        for label, bases in [('unique', self.get_bases(df_raw, sfx, tokens=False)),
+                             ('long', self.get_base_cands(df_raw, sfx))]:
+            unique_diffs = compare(legacy_unique, get_unique_base_cands(bases).reset_index(drop=True))
+            diffs.update((label + ' ' + col, n) for col, n in unique_diffs.items())
+        return diffs
+
+
+def compare(legacy_df, engine_df):
+    """
+    Compares the output of a get_X_bases() function with that of backform() for the same input.
+
+    Returns:
+        Dict mapping every column that differs (or that only one of the two has) to the number of rows in which
+        it differs; empty if the two are the same.
+    """
+    diffs = {}
+    if list(legacy_df.index) != list(engine_df.index):
+        diffs['index'] = abs(len(legacy_df) - len(engine_df)) or len(legacy_df)
+    for col in set(legacy_df.columns) | set(engine_df.columns):
+        if col not in legacy_df.columns or col not in engine_df.columns:
+            diffs[col] = max(len(legacy_df), len(engine_df))
+        else:
+            legacy_vals = legacy_df[col].tolist()
+            engine_vals = engine_df[col].tolist()
+            n_diff = sum(1 for a, b in zip(legacy_vals, engine_vals) if a != b) + abs(len(legacy_vals) - len(engine_vals))
+            if n_diff:
+                diffs[col] = n_diff
+    if not diffs and list(legacy_df.columns) != list(engine_df.columns):
+        diffs['column order'] = 1
+    return diffs
+
+
+# ======================================================
+
+if __name__ == '__main__':
+    # Checks that the engine gives the same results as the get_X_bases() functions of both Backformer versions,
+    # for the samples of all suffixes in 2_random_subsamples/.
+    HERE = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(HERE, '..', '..', '3_validity', 'variables'))
+    import backformer_one
+    import backformer_two
+    import sample_store as store
+
+    SAMPLE_DIR = os.path.join(HERE, '2_random_subsamples')
+    SFXS = sorted(set(fn.split('_')[0] for fn in os.listdir(SAMPLE_DIR)))
+
+    def runs(module, df_raw, sfx):
+        try:
+            module.get_bases_legacy(df_raw, sfx)
+            return True
+        except Exception:
+            return False
+
+    # Missing lemmas must stay missing rather than take the form of another lemma.
+    norms = NormTable()
+    lemmas = ['Ab', None, 'Üb', np.nan, 'Bär']
+    n_failed = 0
+    for form, expected in [('lower', ['ab', None, 'üb', None, 'bär']),
+                           ('has_umlaut', [False, False, False, False, True])]:
+        result = list(norms.lookup(lemmas, form))
+        ok = [None if (x is None or x != x) else x for x in result] == expected
+        print('NormTable %-10s %s' % (form, 'OK' if ok else 'DIFFERENT: %s' % result))
+        n_failed += not ok
+    routed = list(SuffixRouter().route(['Ordnung', None, np.nan]))
+    print('SuffixRouter %-7s %s' % ('missing', 'OK' if routed == ['-ung', '', ''] else 'DIFFERENT: %s' % routed))
+    n_failed += routed != ['-ung', '', '']
+
+    for module in [backformer_one, backformer_two]:
+        for sfx in SFXS:
+            df_raw = store.read_sample(os.path.join(SAMPLE_DIR, sfx + '_subsample'))
+            note = ''
+            if not runs(module, df_raw, sfx):
+                # Some get_X_bases() functions raise an IndexError for lemmas that are too short; compare the rest.
+                distinct = df_raw.drop_duplicates(subset=['lemma', 'cpd.N2'])
+                bad = [idx for idx in distinct.index if not runs(module, distinct.loc[[idx]], sfx)]
+                bad_rows = df_raw.set_index(['lemma', 'cpd.N2']).index.isin(distinct.loc[bad].set_index(['lemma', 'cpd.N2']).index)
+                df_raw = df_raw[~bad_rows]
+                note = ' (without %d rows get_bases() fails on: %s)' % (bad_rows.sum(), ', '.join(distinct.loc[bad, 'lemma']))
+            diffs = module.check_engine(df_raw, sfx)
+            print('%s %-8s %s%s' % (module.__name__, sfx, 'OK' if not diffs else 'DIFFERENT: %s' % diffs, note))
+            n_failed += bool(diffs)
+
+    sys.exit(1 if n_failed else 0)
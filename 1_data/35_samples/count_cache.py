@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Persistent cache for the corpus counts computed in seacow_counts.py, stored in an SQLite file.
+# The counts for a corpus never change, so every query only ever has to be run once.
+#
+# Can also be run from the command line to inspect or clear the cache, e.g.:
+# > python count_cache.py stats
+# > python count_cache.py invalidate decow16a-nano
+# > python count_cache.py invalidate decow16a-nano '%tag="VVINF"%'
+
+import re
+import sqlite3
+import sys
+
+CACHE_FILE    = 'count_cache.sqlite'
+
+
+# ======================================================
+
+
+def normalise_cql(cql):
+  """
+  Normalises the whitespace in a CQL string so that trivially different spellings of the same query share one
+  cache entry. Text inside double quotes (the attribute values) is left untouched.
+
+  Arg:
+    cql: string in CQL format
+  Returns:
+    String to be used as cache key.
+  """
+  parts = re.split(r'("(?:[^"\\]|\\.)*")', cql.strip())
+
+  # Every odd element of parts is a quoted value; only the even ones contain CQL syntax.
+  for idx in range(0, len(parts), 2):
+    part = re.sub(r'\s+', ' ', parts[idx])
+    parts[idx] = re.sub(r' ?([\[\]&|=!<>/()]) ?', r'\1', part)
+
+  return ''.join(parts)
+
+
+class CountCache(object):
+  """
+  Maps (corpus, normalised CQL) to the number of hits, and keeps track of how many lookups it could answer.
+  """
+
+  def __init__(self, path=CACHE_FILE):
+    self.path     = path
+    self.conn     = sqlite3.connect(path)
+    self.n_hits   = 0     # Lookups answered from the cache in this session.
+    self.n_misses = 0     # Lookups that had to go to the server in this session.
+
+    self.conn.execute('CREATE TABLE IF NOT EXISTS counts (corpus TEXT, cql TEXT, hits INTEGER, PRIMARY KEY (corpus, cql))')
+    self.conn.commit()
+
+  def lookup(self, cqls, corpus):
+    """
+    Looks up the given queries.
+
+    Args:
+      cqls: iterable of strings in CQL format
+      corpus: string representing the corpus that was queried
+    Returns:
+      Dict mapping the normalised form of every query found in the cache to its count.
+    """
+    found = {}
+    for key in set(normalise_cql(cql) for cql in cqls):
+      row = self.conn.execute('SELECT hits FROM counts WHERE corpus = ? AND cql = ?', (corpus, key)).fetchone()
+      if row is None:
+        self.n_misses += 1
+      else:
+        self.n_hits += 1
+        found[key] = row[0]
+    return found
+
+  def store(self, cql, hits, corpus):
+    """
+    Saves the count for one query. Call commit() to write it to disk.
+    """
+    self.conn.execute('INSERT OR REPLACE INTO counts VALUES (?, ?, ?)', (corpus, normalise_cql(cql), hits))
+
+  def commit(self):
+    self.conn.commit()
+
+  def invalidate(self, corpus=None, like=None):
+    """
+    Deletes cached counts, e.g. after a change in the corpus or in how queries are built.
+
+    Args:
+      corpus: only delete the counts for this corpus (default: all corpora)
+      like: only delete queries whose normalised form matches this SQL LIKE pattern, e.g. '%tag="VVINF"%'
+    Returns:
+      Number of deleted entries.
+    """
+    conditions = []
+    values = []
+    if corpus is not None:
+      conditions.append('corpus = ?')
+      values.append(corpus)
+    if like is not None:
+      conditions.append('cql LIKE ?')
+      values.append(like)
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    n_deleted = self.conn.execute('DELETE FROM counts' + where, values).rowcount
+    self.conn.commit()
+    return n_deleted
+
+  def stats(self):
+    """
+    Returns a dict with the number of cache hits and misses in this session and the number of stored counts per corpus.
+    """
+    entries = dict(self.conn.execute('SELECT corpus, COUNT(*) FROM counts GROUP BY corpus').fetchall())
+    return {'hits': self.n_hits, 'misses': self.n_misses, 'entries': entries}
+
+  def close(self):
+    self.conn.commit()
+    self.conn.close()
+
+
+# ======================================================
+
+if __name__ == '__main__':
+  USAGE = 'Usage: python count_cache.py stats | invalidate [CORPUS [LIKE_PATTERN]]'
+
+  if len(sys.argv) < 2 or sys.argv[1] not in ('stats', 'invalidate'):
+    sys.exit(USAGE)
+
+  cache = CountCache()
+
+  if sys.argv[1] == 'stats':
+    for corpus, n in sorted(cache.stats()['entries'].items()):
+      print('%s\t%d' % (corpus, n))
+  else:
+    corpus = sys.argv[2] if len(sys.argv) > 2 else None
+    like = sys.argv[3] if len(sys.argv) > 3 else None
+    print('Deleted %d cached counts' % cache.invalidate(corpus, like))
+
+  cache.close()
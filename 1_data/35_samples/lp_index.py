@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+# Compact on-disk indices over a lemma/POS frequency list as distributed with DECOW (e.g. decow16bx.lp: one
+# lemma, tag, and frequency per line, tab-separated): LemmaIndex for looking up lemma/tag counts without querying
+# SeaCOW, and SuffixIndex for listing all lemmas ending in a given suffix.
+#
+# Build both once from the command line, e.g.:
+# > python lp_index.py build ../../3_validity/simplexes/infiles/decow16bx.lp decow16bx_index decow16bx
+# load them with LemmaIndex.load('decow16bx_index') and SuffixIndex.load('decow16bx_index'), or print the size of
+# every suffix's inventory in queries.csv with:
+# > python lp_index.py inventory decow16bx_index
+
+import bisect
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import sys
+
+import numpy as np
+import pandas as pd
+
+READ_CHUNK    = 1000000   # Lines of the frequency list read at a time while building.
+SUFFIX_TAG    = 'NN'      # Tag whose lemmas SuffixIndex lists by default.
+
+try:
+  unichr
+except NameError:   # Python 3
+  unichr = chr
+
+
+# ======================================================
+
+
+def _read_lp(lp_path):
+  """
+  Reads a lemma/POS frequency list in chunks of READ_CHUNK lines (a generator of pandas dfs with the columns
+  lemma, POS, and freq).
+  """
+  return pd.read_csv(lp_path, sep='\t', names=['lemma', 'POS', 'freq'], keep_default_na=False,
+                     quoting=3, dtype={'lemma': str, 'POS': str}, chunksize=READ_CHUNK)  # quoting=3: QUOTE_NONE
+
+
+def _to_bytes(s):
+  return s if isinstance(s, bytes) else s.encode('utf-8')
+
+
+def _to_text(s):
+  return s.decode('utf-8') if isinstance(s, bytes) else s
+
+
+def key_hash(lemma, tag):
+  """
+  Hashes a lemma/tag pair to an unsigned 64-bit integer (the first eight bytes of the MD5 of 'lemma<TAB>tag').
+  With 64 bits, a collision between two of the few million pairs in a frequency list is practically impossible.
+  """
+  digest = hashlib.md5(_to_bytes(lemma) + b'\t' + _to_bytes(tag)).digest()
+  return struct.unpack('<Q', digest[:8])[0]
+
+
+class LemmaIndex(object):
+  """
+  Sorted array of lemma/tag hashes with a parallel array of frequencies. Single lookups are one binary search,
+  bulk lookups one vectorised np.searchsorted(). Loaded indices are memory-mapped, so they're ready at once and
+  only the pages that are actually searched are read.
+  """
+
+  def __init__(self, keys, freqs, tags, corpus):
+    self.keys   = keys      # np.uint64 array, sorted
+    self.freqs  = freqs     # np.int64 array, freqs[i] belongs to keys[i]
+    self.tags   = tags      # list of all tags in the frequency list
+    self.corpus = corpus    # name of the corpus the frequency list was made from
+    self._tag_cache = {}
+
+  @classmethod
+  def build(cls, lp_path, corpus):
+    """
+    Builds the index from a frequency list, reading it in chunks. Lemma/tag pairs that occur more than once are summed.
+
+    Args:
+      lp_path: path of the tab-separated lemma, tag, frequency list
+      corpus: name of the corpus the list was made from, e.g. 'decow16bx'
+    Returns:
+      LemmaIndex
+    """
+    keys = []
+    freqs = []
+    tags = set()
+
+    for chunk in _read_lp(lp_path):
+      keys.append(np.array([key_hash(lemma, tag) for lemma, tag in zip(chunk['lemma'], chunk['POS'])], dtype=np.uint64))
+      freqs.append(chunk['freq'].values.astype(np.int64))
+      tags.update(chunk['POS'].unique())
+
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint64)
+    freqs = np.concatenate(freqs) if freqs else np.zeros(0, dtype=np.int64)
+
+    # Sort by key and sum the frequencies of duplicate keys.
+    order = np.argsort(keys, kind='mergesort')
+    keys, freqs = keys[order], freqs[order]
+    keys, starts = np.unique(keys, return_index=True)
+    freqs = np.add.reduceat(freqs, starts) if len(freqs) else freqs
+
+    return cls(keys, freqs, sorted(tags), corpus)
+
+  def save(self, path):
+    """
+    Saves the index as a directory containing keys.npy, freqs.npy, and meta.json.
+    """
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    np.save(os.path.join(path, 'keys.npy'), self.keys)
+    np.save(os.path.join(path, 'freqs.npy'), self.freqs)
+    with io.open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+      # In Python 2, json.dumps() returns a byte string if everything is ASCII, which io's text files don't take.
+      f.write(_to_text(json.dumps({'corpus': self.corpus, 'tags': self.tags, 'n_keys': len(self.keys)}, ensure_ascii=False)))
+
+  @classmethod
+  def load(cls, path):
+    """
+    Loads an index saved with save(); the arrays are memory-mapped.
+    """
+    with io.open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+      meta = json.loads(f.read())
+    keys = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+    freqs = np.load(os.path.join(path, 'freqs.npy'), mmap_mode='r')
+    return cls(keys, freqs, meta['tags'], meta['corpus'])
+
+  def matching_tags(self, tag):
+    """
+    Returns the tags in the index matched by tag, which is a regex like in CQL (e.g. 'ADJ.' matches ADJA and ADJD).
+    """
+    if tag not in self._tag_cache:
+      pattern = re.compile('(?:%s)$' % tag)
+      self._tag_cache[tag] = [t for t in self.tags if pattern.match(t)]
+    return self._tag_cache[tag]
+
+  def _lookup_hashes(self, hashes):
+    """
+    Looks up an array of key hashes. Returns the frequencies and a boolean array marking the hashes that were found.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    if len(self.keys) == 0:
+      return np.zeros(len(hashes), dtype=np.int64), np.zeros(len(hashes), dtype=bool)
+    idx = np.minimum(np.searchsorted(self.keys, hashes), len(self.keys) - 1)
+    found = self.keys[idx] == hashes
+    return np.where(found, self.freqs[idx], 0), found
+
+  def lookup(self, lemma, tag):
+    """
+    Looks up the frequency of one lemma with the given tag (summed over all tags the tag regex matches).
+
+    Returns:
+      Int, or None if the index contains the lemma with none of the matching tags.
+    """
+    total = None
+    for t in self.matching_tags(tag):
+      h = np.uint64(key_hash(lemma, t))
+      idx = int(self.keys.searchsorted(h))
+      if idx < len(self.keys) and self.keys[idx] == h:
+        total = (total or 0) + int(self.freqs[idx])
+    return total
+
+  def lookup_many(self, pairs):
+    """
+    Looks up many (lemma, tag) pairs at once, with one np.searchsorted() call over all of them.
+
+    Returns:
+      List with an int or None (not in the index) for every pair, in the same order as pairs.
+    """
+    pairs = list(pairs)
+
+    # A tag regex can match several tags, so remember which pair each hash belongs to.
+    owners = []
+    hashes = []
+    for pair_idx, (lemma, tag) in enumerate(pairs):
+      for t in self.matching_tags(tag):
+        owners.append(pair_idx)
+        hashes.append(key_hash(lemma, t))
+
+    freqs, found = self._lookup_hashes(hashes)
+    owners = np.asarray(owners, dtype=np.int64)
+    totals = np.bincount(owners, weights=freqs, minlength=len(pairs))
+    n_found = np.bincount(owners, weights=found, minlength=len(pairs))
+    return [int(total) if n > 0 else None for total, n in zip(totals, n_found)]
+
+  def lookup_df(self, df, lemma_col='unique_candidates', tag_col='pos'):
+    """
+    Looks up every row of a candidate table, e.g. the output of backformer_one.get_unique_base_cands().
+
+    Returns:
+      pandas Series of frequencies (NaN where the pair is not in the index), with the same index as df.
+    """
+    freqs = self.lookup_many(list(zip(df[lemma_col], df[tag_col])))
+    return pd.Series([np.nan if f is None else f for f in freqs], index=df.index, dtype=float)
+
+
+# ======================================================
+
+
+def compile_cql_regex(regex):
+  """
+  Compiles an attribute value from a CQL query so that it matches like in Manatee, i.e. only the whole value.
+  Lookbehinds with alternatives of different lengths, which Manatee accepts but Python's re doesn't, are rewritten,
+  e.g. '(?<!i|ag)' as '(?<!i)(?<!ag)' and '(?<=i|ag)' as '(?:(?<=i)|(?<=ag))'.
+  """
+  def split(match):
+    kind, alternatives = match.group(1), match.group(2).split('|')
+    if kind == '!':
+      return ''.join('(?<!%s)' % alt for alt in alternatives)
+    return '(?:%s)' % '|'.join('(?<=%s)' % alt for alt in alternatives)
+  return re.compile('(?:%s)$' % re.sub(r'\(\?<([!=])([^()]*\|[^()]*)\)', split, regex))
+
+
+def _literal_tail(regex):
+  """
+  Returns the literal string that every match of a lemma regex like '^.*(?<!ik)er$' must end with ('er'), or ''
+  if the end of the regex isn't literal.
+  """
+  regex = regex[:-1] if regex.endswith('$') else regex
+  tail = []
+  for idx in range(len(regex) - 1, -1, -1):
+    char = regex[idx]
+    if char in '.^$*+?()[]{}|\\' or (idx > 0 and regex[idx-1] == '\\'):
+      break
+    tail.append(char)
+
+  return ''.join(reversed(tail))
+
+
+def parse_lemma_query(cql):
+  """
+  Takes apart a single-token query in the format of queries.csv, e.g.
+  '[lemma="^.*ist$" & lemma!="Mist|Geist" & tag="NN"] within <s/>'.
+
+  Returns:
+    Tuple of the lemma regex, list of the regexes of excluded lemmas, and the tag (None where the query has none).
+  """
+  lemma = re.search(r'lemma\s*=\s*"([^"]*)"', cql)
+  exclusions = re.findall(r'lemma\s*!=\s*"([^"]*)"', cql)
+  tag = re.search(r'tag\s*=\s*"([^"]*)"', cql)
+  return (lemma.group(1) if lemma else None), exclusions, (tag.group(1) if tag else None)
+
+
+class SuffixIndex(object):
+  """
+  All lemmas with one tag in a frequency list, sorted by their reversed spelling, so that the lemmas ending in a
+  suffix form one contiguous range that two binary searches find.
+  """
+
+  def __init__(self, reversed_lemmas, freqs, tag, corpus):
+    self.reversed_lemmas = reversed_lemmas    # sorted list of reversed lemmas
+    self.freqs           = freqs              # list of ints, freqs[i] belongs to reversed_lemmas[i]
+    self.tag             = tag
+    self.corpus          = corpus
+
+  @classmethod
+  def build(cls, lp_path, corpus, tag=SUFFIX_TAG):
+    """
+    Builds the index from a frequency list, reading it in chunks and keeping only the lemmas whose tag matches tag
+    (a regex). The frequencies of a lemma with several matching tags are summed.
+
+    Args:
+      lp_path: path of the tab-separated lemma, tag, frequency list
+      corpus: name of the corpus the list was made from, e.g. 'decow16bx'
+      tag: tag of the lemmas to index
+    Returns:
+      SuffixIndex
+    """
+    pattern = '(?:%s)$' % tag
+    chunks = [chunk[chunk['POS'].str.match(pattern)] for chunk in _read_lp(lp_path)]
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    if chunks:
+      freqs = pd.concat(chunks).groupby('lemma')['freq'].sum()
+    else:
+      freqs = pd.Series([], dtype=np.int64)
+
+    pairs = sorted((lemma[::-1], int(freq)) for lemma, freq in freqs.items())
+    return cls([rev for rev, _ in pairs], [freq for _, freq in pairs], tag, corpus)
+
+  @staticmethod
+  def _file(path, tag):
+    return os.path.join(path, 'suffixes_%s.tsv' % re.sub(r'\W', '_', tag))
+
+  def save(self, path):
+    """
+    Saves the index in the directory path (next to a LemmaIndex, if there is one), as a file with one reversed
+    lemma and its frequency per line.
+    """
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    with io.open(self._file(path, self.tag), 'w', encoding='utf-8') as f:
+      f.write(u'# %s\n' % self.corpus)
+      for rev, freq in zip(self.reversed_lemmas, self.freqs):
+        f.write(u'%s\t%d\n' % (rev, freq))
+
+  @classmethod
+  def load(cls, path, tag=SUFFIX_TAG):
+    """
+    Loads an index saved with save().
+    """
+    reversed_lemmas = []
+    freqs = []
+    with io.open(cls._file(path, tag), encoding='utf-8') as f:
+      corpus = f.readline()[2:].rstrip('\n')
+      for line in f:
+        rev, freq = line.rstrip('\n').rsplit('\t', 1)
+        reversed_lemmas.append(rev)
+        freqs.append(int(freq))
+    return cls(reversed_lemmas, freqs, tag, corpus)
+
+  def _range(self, suffix):
+    """
+    Returns the start and end position of the lemmas ending in suffix.
+    """
+    if not suffix:
+      return 0, len(self.reversed_lemmas)
+    prefix = suffix[::-1]
+    upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+    return (bisect.bisect_left(self.reversed_lemmas, prefix), bisect.bisect_left(self.reversed_lemmas, upper))
+
+  def inventory(self, suffix):
+    """
+    Lists every lemma ending in suffix.
+
+    Arg:
+      suffix: string, e.g. 'ament' (case-sensitive, without hyphen)
+    Returns:
+      pandas df with the columns lemma and freq, most frequent lemmas first.
+    """
+    start, end = self._range(suffix)
+    df = pd.DataFrame({'lemma': pd.Series([rev[::-1] for rev in self.reversed_lemmas[start:end]], dtype=object),
+                       'freq': np.asarray(self.freqs[start:end], dtype=np.int64)}, columns=['lemma', 'freq'])
+    return df.sort_values(['freq', 'lemma'], ascending=[False, True]).reset_index(drop=True)
+
+  def query_inventory(self, cql):
+    """
+    Lists the lemmas a sampling query from queries.csv (or MATRIX_Q in ../large_samples/sample_sfxs.py) would
+    match, without running it: the literal end of the lemma regex selects a range of the index, which is then
+    filtered with the full regex and the lemma!= exclusions.
+
+    Arg:
+      cql: string in CQL format with a lemma regex and (optionally) lemma!= exclusions and a tag
+    Returns:
+      pandas df with the columns lemma and freq, most frequent lemmas first.
+    """
+    lemma_regex, exclusions, tag = parse_lemma_query(cql)
+    if tag is not None and tag != self.tag:
+      raise ValueError('Index lists %s lemmas, but the query asks for %s' % (self.tag, tag))
+
+    lemma_regex = lemma_regex if lemma_regex is not None else '.*'
+    df = self.inventory(_literal_tail(lemma_regex))
+
+    # Python's re rather than pandas' str.match(), whose engine may not support lookarounds.
+    pattern = compile_cql_regex(lemma_regex)
+    excluded = [compile_cql_regex(exclusion) for exclusion in exclusions]
+    keep = [bool(pattern.match(lemma)) and not any(ex.match(lemma) for ex in excluded) for lemma in df['lemma']]
+    return df[np.asarray(keep, dtype=bool)].reset_index(drop=True)
+
+
+def inventory_table(index, queries_path='queries.csv'):
+  """
+  Sizes up the inventory of every suffix in queries.csv (see SuffixIndex.query_inventory()).
+
+  Args:
+    index: SuffixIndex
+    queries_path: path of queries.csv
+  Returns:
+    pandas df with the columns morph, types, tokens, and hapaxes (lemmas with a frequency of 1), one row per query.
+  """
+  queries = pd.read_csv(queries_path).dropna(subset=['query'])
+  rows = []
+  for morph, cql in zip(queries['morph'], queries['query']):
+    inventory = index.query_inventory(cql)
+    rows.append({'morph': morph, 'types': len(inventory), 'tokens': int(inventory['freq'].sum()),
+                 'hapaxes': int((inventory['freq'] == 1).sum())})
+  return pd.DataFrame(rows, columns=['morph', 'types', 'tokens', 'hapaxes'])
+
+
+# ======================================================
+
+if __name__ == '__main__':
+  USAGE = 'Usage: python lp_index.py build LP_FILE INDEX_DIR CORPUS | inventory INDEX_DIR [QUERIES_CSV]'
+
+  if len(sys.argv) == 5 and sys.argv[1] == 'build':
+    index = LemmaIndex.build(sys.argv[2], sys.argv[4])
+    index.save(sys.argv[3])
+    print('Indexed %d lemma/tag pairs from %s' % (len(index.keys), sys.argv[2]))
+
+    suffix_index = SuffixIndex.build(sys.argv[2], sys.argv[4])
+    suffix_index.save(sys.argv[3])
+    print('Indexed %d %s lemmas by suffix' % (len(suffix_index.freqs), suffix_index.tag))
+
+  elif len(sys.argv) in (3, 4) and sys.argv[1] == 'inventory':
+    table = inventory_table(SuffixIndex.load(sys.argv[2]), *sys.argv[3:])
+    print(table.to_string(index=False))
+
+  else:
+    sys.exit(USAGE)
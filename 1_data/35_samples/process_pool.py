@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Pools of forked worker processes, shared by backformer_engine.py (Backformer stages, DErivBase matching) and
+# ../../2_interpretability/bootstrap_engine.py (bootstrapping), so that neither has to import the other.
+
+import multiprocessing
+
+N_PROCESSES = multiprocessing.cpu_count()   # Default number of worker processes.
+
+
+# ======================================================
+
+
+def fork_pool(n_workers, initializer=None, initargs=()):
+    """
+    Pool of n_workers forked processes (where the platform can fork; Python 2 always forks on Unix).
+
+    Args:
+        n_workers: number of processes
+        initializer: optional function that every worker calls with initargs when it starts, e.g. to hand it data
+            that all its tasks share (with fork, initargs are inherited rather than pickled)
+        initargs: tuple of arguments of initializer
+    Returns:
+        multiprocessing Pool.
+    """
+    if hasattr(multiprocessing, 'get_context') and 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork').Pool(n_workers, initializer, initargs)
+    return multiprocessing.Pool(n_workers, initializer, initargs)
+
+
+def run_parallel(fn, jobs, n_workers=N_PROCESSES):
+    """
+    Runs fn on every job on a pool of processes, e.g. the Backformer stage of every suffix, and returns the results
+    in the same order as jobs, however long each one takes. Every worker takes the next job as soon as it is done
+    with one, so a few big suffixes don't hold up the rest.
+
+    The workers are forked, so fn may be a function defined in a script or notebook, and it can read large
+    globals (e.g. a df that all jobs share) without them being pickled. Only the jobs and the results are: pass
+    something small like a suffix or a path as the job, read the data in fn, and return only what is needed.
+
+    Args:
+        fn: function of one job
+        jobs: iterable of jobs, e.g. suffixes
+        n_workers: number of processes (1 runs the jobs one after another in this process)
+    Returns:
+        List of the results of fn, in the order of jobs.
+    """
+    jobs = list(jobs)
+    if n_workers <= 1 or len(jobs) <= 1:
+        return [fn(job) for job in jobs]
+
+    pool = fork_pool(min(n_workers, len(jobs)))
+    try:
+        return pool.map(fn, jobs, chunksize=1)   # map() returns the results in input order.
+    finally:
+        pool.close()
+        pool.join()
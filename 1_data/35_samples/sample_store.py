@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Functions for writing and reading the samples as Parquet files, one per suffix. Parquet stores every column
+# separately and dictionary-encodes the string columns, so the URLs and document IDs that repeat on every row only
+# take up space once, and a notebook that only needs the lemmas only has to read the lemma column.
+# Needs pyarrow; without it, everything falls back to CSV.
+#
+# Existing CSV samples can be converted from the command line, e.g.:
+# > python sample_store.py convert 7_analysis_samples ../large_samples/heit.csv
+# which writes a .parquet file next to every CSV (read_sample() prefers these from then on).
+
+import glob
+import os
+import sys
+
+import pandas as pd
+
+try:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  HAVE_PYARROW = True
+except ImportError:
+  HAVE_PYARROW = False
+
+SAMPLE_EXT      = '.parquet' if HAVE_PYARROW else '.csv'   # Extension of newly written samples.
+PARQUET_OPTIONS = {'use_dictionary': True, 'compression': 'snappy'}
+
+
+# ======================================================
+
+
+def sample_path(path):
+  """
+  Finds the file of a sample. If path has no extension, the Parquet file is taken if there is one (and pyarrow is
+  installed), otherwise the CSV file.
+
+  Arg:
+    path: path of the sample, with or without extension, e.g. '7_analysis_samples/-ung_sample'
+  Returns:
+    Path of the file to read.
+  """
+  if os.path.splitext(path)[1] in ('.parquet', '.csv'):
+    return path
+  if HAVE_PYARROW and os.path.exists(path + '.parquet'):
+    return path + '.parquet'
+  return path + '.csv'
+
+
+def read_sample(path, columns=None):
+  """
+  Reads a sample from a Parquet or CSV file (see sample_path()), optionally only some of its columns.
+
+  Args:
+    path: path of the sample, with or without extension
+    columns: list of the columns to read (default: all). For Parquet files, the other columns aren't even read
+      from disk.
+  Returns:
+    pandas df
+  """
+  path = sample_path(path)
+  if path.endswith('.parquet'):
+    return pq.read_table(path, columns=columns).to_pandas()
+  return pd.read_csv(path, usecols=columns)
+
+
+def write_sample(df, path):
+  """
+  Writes a sample as Parquet (with dictionary-encoded columns) if path ends in '.parquet', otherwise as CSV.
+  """
+  if path.endswith('.parquet'):
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, **PARQUET_OPTIONS)
+  else:
+    df.to_csv(path, index=False, encoding='UTF-8')
+
+
+def convert(csv_path):
+  """
+  Writes a Parquet copy of a CSV sample next to it.
+
+  Returns:
+    Path of the Parquet file.
+  """
+  parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
+  write_sample(pd.read_csv(csv_path), parquet_path)
+  return parquet_path
+
+
+# ======================================================
+
+if __name__ == '__main__':
+  if len(sys.argv) < 3 or sys.argv[1] != 'convert':
+    sys.exit('Usage: python sample_store.py convert CSV_FILE_OR_DIR [...]')
+  if not HAVE_PYARROW:
+    sys.exit('Converting to Parquet needs pyarrow')
+
+  for arg in sys.argv[2:]:
+    for csv_path in (sorted(glob.glob(os.path.join(arg, '*.csv'))) if os.path.isdir(arg) else [arg]):
+      parquet_path = convert(csv_path)
+      print('%s: %d -> %d bytes' % (csv_path, os.path.getsize(csv_path), os.path.getsize(parquet_path)))
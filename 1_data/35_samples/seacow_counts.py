@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# Functions for counting the hits of CQL queries on the SeaCOW server.
+# Used by 2_count_derivs_and_bases.py and 5_manual_query.py.
+# get_counts_batched() can also take its counts from an offline LemmaIndex (see lp_index.py) where possible.
+
+import re
+import time
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from SeaCOW import Query, Nonprocessor, ConcordanceLoader
+from count_cache import normalise_cql
+
+N_WORKERS     = 8     # How many queries may run on the server at the same time.
+N_RETRIES     = 3     # How often a failed query is repeated before giving up.
+RETRY_WAIT    = 5     # Seconds to wait before the first retry; doubled after every further failure.
+BATCH_SIZE    = 200   # How many lemmas get_counts_batched() puts into one query.
+TALLY_HITS    = 100000   # How many matches get_lemma_tally() may go through; batches with more hits are split up.
+
+
+# ======================================================
+
+
+def get_count(cql, corpus):
+  """
+  Counts the number of tokens for the given query in the given corpus. Returns number of hits (i.e., tokens).
+  """
+
+  # Create a Query object and set whatever needs to be set.
+  q = Query()
+  q.corpus          = corpus                # Lower-case name of the corpusto use.
+  q.string          = cql                     # A normal CQL string as used in NoSketchEngine.
+  q.max_hits        = -1
+  q.attributes      = []                      # For counting, you don't need word attributes.
+  q.structures      = []                      # ... you don't need structural attributes.
+  q.references      = []                      # ... you don't need reference attrs.
+  q.container       = 's'                       # Which container structure should be used? None is OK
+                                              # only if class is Nonprocessor.
+
+  # Using the deduplicator would NOT change the outcome. Switch off.
+  q.set_deduplication(off = True)
+
+  # Create a Processor object and attach it to the Query object.
+  # The Nonprocessor processor does nothing. You can work with the results
+  # yourself in the finalise method or just get the hits value from the
+  # query object. It is the concordance as seported by Manatee.
+  p                 = Nonprocessor()  # Create a processor object of appropriate type.
+  q.processor       = p               # Attach the processor to the query.
+  q.run()                             # Run the query.
+  return q.hits
+
+
+class LemmaTally(ConcordanceLoader):
+  """
+  Processor that counts how often each lemma occurs among the matches of a query, instead of keeping the concordance.
+  Every concordance line is counted and thrown away as soon as ConcordanceLoader has built it.
+  """
+
+  def __init__(self):
+    ConcordanceLoader.__init__(self)
+    self.full_structure = True
+    self.tally = {}
+
+  def process(self, *args, **kwargs):
+    ConcordanceLoader.process(self, *args, **kwargs)
+    for conc in self.concordance:
+      lemma = conc['match'][0]['lemma']
+      self.tally[lemma] = self.tally.get(lemma, 0) + 1
+    del self.concordance[:]
+
+
+def escape_lemma(lemma):
+  """
+  Escapes the regex characters in a lemma, so that a query for it only matches the lemma itself.
+  """
+  return re.sub(r'([.^$*+?()\[\]{}|\\"])', r'\\\1', lemma)
+
+
+def lemma_tag_cql(lemma, tag):
+  """
+  Formats the query for counting a single lemma with the given tag (the same format as in backformer_one.add_cql(),
+  but with the lemma escaped, see escape_lemma(), so that it counts the same tokens as get_lemma_tally()).
+  """
+  return '[lemma="%s" & tag="%s"] within <s/>' % (escape_lemma(lemma), tag)
+
+
+def get_lemma_tally(lemmas, tag, corpus, max_hits=TALLY_HITS):
+  """
+  Counts the tokens of several lemmas with the same tag with as few queries as possible. First, the hits of an
+  alternation over all of them are counted (like get_count(), without going through them). If there are none,
+  all lemmas have 0 hits; if there are more than max_hits, the lemmas are split into two halves, which are counted
+  the same way; otherwise the hits are gone through once and tallied by lemma. A single lemma only needs the first
+  count, so frequent lemmas are never gone through.
+
+  Args:
+    lemmas: list of strings, the lemmas to count
+    tag: string representing the tag the lemmas must have (a regex, e.g. 'ADJ.')
+    corpus: string representing the corpus to query
+    max_hits: maximum number of matches to go through in one query
+  Returns:
+    Dict mapping every lemma in lemmas to its number of hits (0 if it wasn't found).
+  """
+  cql = '[lemma="%s" & tag="%s"] within <s/>' % ('|'.join(escape_lemma(lemma) for lemma in lemmas), tag)
+  n_hits = get_count(cql, corpus)
+  if n_hits == 0:
+    return dict((lemma, 0) for lemma in lemmas)
+  if len(lemmas) == 1:
+    return {lemmas[0]: n_hits}
+  if n_hits > max_hits:
+    half = len(lemmas) // 2
+    tally = get_lemma_tally(lemmas[:half], tag, corpus, max_hits)
+    tally.update(get_lemma_tally(lemmas[half:], tag, corpus, max_hits))
+    return tally
+
+  q = Query()
+  q.corpus          = corpus
+  q.string          = cql
+  q.max_hits        = -1
+  q.attributes      = ['lemma']                 # Only need the lemma to tell the alternatives apart.
+  q.structures      = []
+  q.references      = []
+  q.container       = 's'
+  q.set_deduplication(off = True)
+
+  p                 = LemmaTally()
+  q.processor       = p
+  q.run()
+
+  tally = dict((lemma, 0) for lemma in lemmas)
+  tally.update(p.tally)
+  return tally
+
+
+def _retry(fn, args, retries=N_RETRIES, wait=RETRY_WAIT):
+  """
+  Calls fn(*args), but repeats a failed call up to `retries` times, waiting twice as long after every failure.
+  If the last attempt fails as well, its error is raised.
+  """
+  for attempt in range(retries + 1):
+    try:
+      return fn(*args)
+    except Exception:
+      if attempt == retries:
+        raise
+      time.sleep(wait * 2**attempt)
+
+
+def get_count_retry(cql, corpus, retries=N_RETRIES, wait=RETRY_WAIT):
+  """
+  Same as get_count(), but repeats a failed query (see _retry()).
+  """
+  return _retry(get_count, (cql, corpus), retries, wait)
+
+
+def _count_job(job):
+  """
+  Runs one (cql, corpus, retries, wait) job. Pool.imap() only passes a single argument, hence the tuple.
+  """
+  return get_count_retry(*job)
+
+
+def _tally_job(job):
+  """
+  Runs one (lemmas, tag, corpus, retries, wait) job for get_counts_batched().
+  """
+  lemmas, tag, corpus, retries, wait = job
+  return _retry(get_lemma_tally, (lemmas, tag, corpus), retries, wait)
+
+
+def _run_jobs(fn, jobs, n_workers, use_threads):
+  """
+  Generator that runs fn on every job on a pool of n_workers and yields the results in input order, as soon as
+  they are available.
+  """
+  if n_workers <= 1 or len(jobs) <= 1:
+    for job in jobs:
+      yield fn(job)
+    return
+
+  pool = ThreadPool(n_workers) if use_threads else Pool(n_workers)
+  try:
+    for result in pool.imap(fn, jobs):   # imap() returns the results in input order.
+      yield result
+  finally:
+    pool.close()
+    pool.join()
+
+
+def get_counts(cqls, corpus, n_workers=N_WORKERS, use_threads=False, retries=N_RETRIES, wait=RETRY_WAIT, cache=None):
+  """
+  Counts the hits for a whole batch of queries, running up to n_workers of them at the same time.
+  Queries that occur more than once in cqls are only run once.
+
+  Args:
+    cqls: iterable of strings in CQL format
+    corpus: string representing the corpus to query ('decow16a-nano', 'decow16b', 'encow16a', 'encow16a-nano')
+    n_workers: maximum number of queries that run concurrently (1 runs them one after another)
+    use_threads: if True, use a pool of threads instead of processes. Processes are the default, since then
+      every worker has its own connection to Manatee.
+    retries: how often a failed query is repeated before the whole batch fails
+    wait: seconds to wait before the first retry
+    cache: optional CountCache (see count_cache.py). Queries found in it are not sent to the server, and every new
+      count is saved in it as soon as it comes back.
+  Returns:
+    List of ints containing the number of hits for each query, in the same order as cqls.
+  """
+  cqls = list(cqls)
+  counts = cache.lookup(cqls, corpus) if cache is not None else {}
+
+  # Collect the queries that still need to be run, each only once.
+  todo = []
+  for cql in cqls:
+    key = normalise_cql(cql)
+    if key not in counts:
+      counts[key] = None
+      todo.append(cql)
+
+  jobs = [(cql, corpus, retries, wait) for cql in todo]
+  try:
+    for idx, count in enumerate(_run_jobs(_count_job, jobs, n_workers, use_threads)):
+      counts[normalise_cql(todo[idx])] = count
+      if cache is not None:
+        cache.store(todo[idx], count, corpus)
+  finally:
+    # Also keep whatever was counted before a failure, so that a rerun doesn't have to repeat it.
+    if cache is not None:
+      cache.commit()
+
+  return [counts[normalise_cql(cql)] for cql in cqls]
+
+
+def get_counts_batched(pairs, corpus, batch_size=BATCH_SIZE, n_workers=N_WORKERS, use_threads=False,
+                       retries=N_RETRIES, wait=RETRY_WAIT, cache=None, index=None):
+  """
+  Counts the tokens of many lemma/tag pairs with few queries. The pairs are grouped by tag, and each group is
+  queried batch_size lemmas at a time as one alternation (see get_lemma_tally()); the hits are then split up by
+  lemma locally. Returns the same counts as running lemma_tag_cql() for every pair with get_counts().
+
+  Args:
+    pairs: iterable of (lemma, tag) tuples
+    corpus: string representing the corpus to query
+    batch_size: maximum number of lemmas per query
+    n_workers, use_threads, retries, wait: as in get_counts(); every batch is one job
+    cache: optional CountCache. Counts are looked up and stored under lemma_tag_cql(lemma, tag), so they are
+      shared with get_counts() for the same (escaped) queries.
+    index: optional LemmaIndex (see lp_index.py) built from the frequency list of the same corpus. Pairs found in
+      it are neither looked up in the cache nor sent to the server; only the pairs missing from it are.
+  Returns:
+    List of ints containing the number of hits for each pair, in the same order as pairs.
+  """
+  pairs = [tuple(pair) for pair in pairs]
+  cqls = [lemma_tag_cql(lemma, tag) for lemma, tag in pairs]
+
+  counts = {}
+  if index is not None:
+    if index.corpus != corpus:
+      raise ValueError('Index was built for %s, not %s' % (index.corpus, corpus))
+    for cql, count in zip(cqls, index.lookup_many(pairs)):
+      if count is not None:
+        counts[normalise_cql(cql)] = count
+
+  if cache is not None:
+    counts.update(cache.lookup([cql for cql in cqls if normalise_cql(cql) not in counts], corpus))
+
+  # Group the pairs that still need to be counted by tag, each pair only once.
+  todo = {}
+  for (lemma, tag), cql in zip(pairs, cqls):
+    key = normalise_cql(cql)
+    if key not in counts:
+      counts[key] = None
+      todo.setdefault(tag, []).append(lemma)
+
+  jobs = []
+  for tag in sorted(todo):
+    lemmas = todo[tag]
+    for start in range(0, len(lemmas), batch_size):
+      jobs.append((lemmas[start:start+batch_size], tag, corpus, retries, wait))
+
+  try:
+    for idx, tally in enumerate(_run_jobs(_tally_job, jobs, n_workers, use_threads)):
+      tag = jobs[idx][1]
+      for lemma, count in tally.items():
+        cql = lemma_tag_cql(lemma, tag)
+        counts[normalise_cql(cql)] = count
+        if cache is not None:
+          cache.store(cql, count, corpus)
+  finally:
+    if cache is not None:
+      cache.commit()
+
+  return [counts[normalise_cql(cql)] for cql in cqls]
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+# Functions for drawing samples of derivations from SeaCOW and writing them to disk, and a runner that draws
+# several samples in parallel and can pick up where it left off.
+# Used by 1_sample_sfxs.py and ../large_samples/sample_sfxs.py.
+
+import hashlib
+import os
+import random
+import traceback
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+import pandas as pd
+
+import sample_store
+from SeaCOW import Query, ConcordanceLoader
+
+CHUNK_SIZE    = 10000   # How many matches are kept in memory before they're written to disk.
+N_WORKERS     = 4       # How many sampling queries may run on the server at the same time.
+RAW_COLUMNS   = ['word', 'lemma', 'compana', 'doc.id', 'doc.url', 's.idx']
+
+
+# ======================================================
+
+
+def conc_to_row(conc):
+  """
+  Extracts the information from a concordance line (as built by ConcordanceLoader with full_structure = True)
+  that we probably care about.
+
+  Arg:
+    conc: dict containing one concordance line
+  Returns:
+    Dict with the keys in RAW_COLUMNS.
+  """
+  return {
+    'word': conc['match'][0]['word'],
+    'lemma': conc['match'][0]['lemma'],
+    'compana': conc['match'][0]['compana'],
+    'doc.id': conc['meta']['doc.id'],
+    'doc.url': conc['meta']['doc.url'],
+    's.idx': conc['meta']['s.idx']
+  }
+
+
+class StreamingLoader(ConcordanceLoader):
+  """
+  Processor that writes the matches of a query to a CSV or Parquet file in chunks while the query is running,
+  instead of keeping the whole concordance in memory. Each concordance line is reduced to a flat row (see
+  conc_to_row()) as soon as ConcordanceLoader has built it, so memory use only depends on chunk_size.
+
+  If sample_size is given, only a uniform random sample of that many matches is kept instead (reservoir sampling:
+  every match replaces a random one of those kept so far with the right probability, so the matches that aren't
+  sampled are never stored). The sample is written in corpus order when the query has finished.
+  """
+
+  def __init__(self, path, transform=None, chunk_size=CHUNK_SIZE, sample_size=None, seed=None):
+    """
+    Args:
+      path: file to write to. Files ending in '.parquet' are written as Parquet (needs pyarrow), all others as CSV.
+      transform: optional function applied to every chunk (a pandas df with the columns in RAW_COLUMNS)
+        before it is written, e.g. to add or rearrange columns. Must work on each row independently.
+      chunk_size: number of rows per chunk
+      sample_size: if given, the number of matches to sample (all matches are kept if there are fewer)
+      seed: seed for the random sample, so that the same query draws the same sample
+    """
+    ConcordanceLoader.__init__(self)
+    self.full_structure = True     # Convert token attributes to dicts as well, otherwise |-separated.
+    self.path           = path
+    self.transform      = transform
+    self.chunk_size     = chunk_size
+    self.rows           = []
+    self.n_rows         = 0        # Number of rows written so far.
+    self.writer         = None     # Parquet writer, opened with the first chunk.
+    self.sample_size    = sample_size
+    self.rng            = random.Random(seed)
+    self.reservoir      = []       # (match number, row) tuples of the sampled matches.
+    self.n_seen         = 0        # Number of matches processed so far.
+
+  def process(self, *args, **kwargs):
+    ConcordanceLoader.process(self, *args, **kwargs)
+    for conc in self.concordance:
+      if self.sample_size is None:
+        self.rows.append(conc_to_row(conc))
+      else:
+        self.sample(conc)
+      self.n_seen += 1
+    del self.concordance[:]
+    if len(self.rows) >= self.chunk_size:
+      self.flush()
+
+  def sample(self, conc):
+    """
+    Puts a match into the reservoir if it is drawn (Algorithm R): the first sample_size matches are all kept, after
+    that the n-th one replaces a random kept one with probability sample_size/n.
+    """
+    if self.n_seen < self.sample_size:
+      self.reservoir.append((self.n_seen, conc_to_row(conc)))
+    else:
+      idx = self.rng.randint(0, self.n_seen)
+      if idx < self.sample_size:
+        self.reservoir[idx] = (self.n_seen, conc_to_row(conc))
+
+  def flush(self, force=False):
+    """
+    Writes the rows collected so far to disk. Empty chunks are only written if force is True (so that the file
+    exists and has a header even if the query had no matches).
+    """
+    if not self.rows and not (force and self.n_rows == 0):
+      return
+
+    chunk = pd.DataFrame(self.rows, columns=RAW_COLUMNS)
+    if self.transform is not None:
+      chunk = self.transform(chunk)
+
+    if self.path.endswith('.parquet'):
+      table = sample_store.pa.Table.from_pandas(chunk, preserve_index=False)
+      if self.writer is None:
+        self.writer = sample_store.pq.ParquetWriter(self.path, table.schema, **sample_store.PARQUET_OPTIONS)
+      self.writer.write_table(table.cast(self.writer.schema))
+    else:
+      chunk.to_csv(self.path, mode='w' if self.n_rows == 0 else 'a', header=(self.n_rows == 0),
+                   index=False, encoding='UTF-8')
+
+    self.n_rows += len(chunk)
+    self.rows = []
+
+  def close(self):
+    """
+    Writes the last chunk (or the sample) and closes the file.
+    """
+    if self.sample_size is not None:
+      self.reservoir.sort(key=lambda entry: entry[0])
+      for start in range(0, len(self.reservoir), self.chunk_size):
+        self.rows = [row for _, row in self.reservoir[start:start+self.chunk_size]]
+        self.flush()
+      self.reservoir = []
+    self.flush(force=True)
+    if self.writer is not None:
+      self.writer.close()
+      self.writer = None
+
+
+def conduct_query(cql_string, corpus, path, transform=None, max_hits=100000, chunk_size=CHUNK_SIZE,
+                  sample_size=None, seed=None):
+  """
+  Queries the given corpus and writes the matches to a file as they arrive, or a random sample of them once the
+  query has finished (see StreamingLoader).
+
+  Args:
+    cql_string: string in CQL format
+    corpus: string representing the corpus to query ('decow16a-nano', 'decow16b', 'encow16a', 'encow16a-nano')
+    path: file to write the matches to (CSV, or Parquet if it ends in '.parquet')
+    transform: optional function applied to every chunk of matches before it is written
+    max_hits: maximum number of matches to retrieve (-1 for all)
+    chunk_size: number of matches kept in memory at a time
+    sample_size: if given, only write a uniform random sample of this many of the (at most max_hits) matches
+    seed: seed for the random sample
+  Returns:
+    Number of rows written to path.
+  """
+
+  q = Query()
+  q.corpus          = corpus
+  q.string          = cql_string
+  q.max_hits        = max_hits
+  q.attributes      = ['word', 'lemma', 'compana']
+  q.structures      = ['s']
+  q.references      = ['doc.url', 'doc.id', 's.idx']
+  q.container       = 's'
+  q.set_deduplication()
+
+  p                 = StreamingLoader(path, transform, chunk_size, sample_size, seed)
+  q.processor       = p
+  try:
+    q.run()
+  finally:
+    p.close()
+
+  return p.n_rows
+
+
+# ======================================================
+
+
+def file_md5(path):
+  """
+  Computes the MD5 checksum of a file, reading it in blocks.
+  """
+  md5 = hashlib.md5()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      md5.update(block)
+  return md5.hexdigest()
+
+
+def read_manifest(manifest_path):
+  """
+  Reads the manifest written by run_sampling_jobs().
+
+  Arg:
+    manifest_path: path of the manifest CSV
+  Returns:
+    Dict mapping job names to dicts with the keys name, path, n_rows, md5 (empty if there is no manifest yet).
+  """
+  if not os.path.exists(manifest_path):
+    return {}
+  manifest = pd.read_csv(manifest_path, dtype={'name': str, 'path': str, 'md5': str})
+  return dict((row['name'], row) for row in manifest.to_dict('records'))
+
+
+def write_manifest(manifest, manifest_path):
+  """
+  Writes the manifest (dict as returned by read_manifest()) to disk, replacing the old file in one step.
+  """
+  tmp_path = manifest_path + '.tmp'
+  pd.DataFrame(sorted(manifest.values(), key=lambda row: row['name']),
+               columns=['name', 'path', 'n_rows', 'md5']).to_csv(tmp_path, index=False)
+  os.rename(tmp_path, manifest_path)
+
+
+def is_finished(entry):
+  """
+  Checks whether a manifest entry belongs to a finished job: its file must still exist and be unchanged.
+  """
+  return os.path.exists(entry['path']) and file_md5(entry['path']) == entry['md5']
+
+
+def job_seed(seed, name):
+  """
+  Derives the seed for one job from the seed of the whole run and the job's name, so that every job draws the
+  same sample no matter in which order or on which worker it runs.
+  """
+  if seed is None:
+    return None
+  return int(hashlib.md5(('%s:%s' % (seed, name)).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _sampling_job(job):
+  """
+  Runs one (name, cql_string, corpus, path, transform, max_hits, sample_size, seed) job. The matches are first written to a
+  temporary file, which only replaces path once the query has finished, so a crashed job never leaves behind a
+  file that looks complete.
+
+  Returns:
+    Tuple of name, manifest entry (None if the job failed), and error message (None if it succeeded).
+  """
+  name, cql_string, corpus, path, transform, max_hits, sample_size, seed = job
+  root, ext = os.path.splitext(path)
+  tmp_path = root + '.part' + ext
+  try:
+    n_rows = conduct_query(cql_string, corpus, tmp_path, transform, max_hits, sample_size=sample_size,
+                           seed=job_seed(seed, name))
+    if os.path.exists(path):
+      os.remove(path)
+    os.rename(tmp_path, path)
+    return name, {'name': name, 'path': path, 'n_rows': n_rows, 'md5': file_md5(path)}, None
+  except Exception:
+    return name, None, traceback.format_exc()
+
+
+def run_sampling_jobs(jobs, corpus, manifest_path, max_hits=100000, n_workers=N_WORKERS, use_threads=False,
+                      sample_size=None, seed=None):
+  """
+  Runs several sampling queries in parallel, and records every finished one in a manifest (with its number of
+  rows and the checksum of its file). Jobs that are already in the manifest and whose files are unchanged are
+  skipped, so after a crash the same call only reruns what is missing. A failed job doesn't stop the others.
+
+  Args:
+    jobs: list of (name, cql_string, path, transform) tuples; see conduct_query() for path and transform.
+      transform must be picklable (a module-level function or a functools.partial of one).
+    corpus: string representing the corpus to query
+    manifest_path: path of the manifest CSV
+    max_hits: maximum number of matches per query (-1 for all)
+    n_workers: maximum number of queries that run concurrently (1 runs them one after another)
+    use_threads: if True, use a pool of threads instead of processes
+    sample_size: if given, every job only writes a random sample of this many matches (see StreamingLoader)
+    seed: seed for the samples; each job's seed is derived from it and the job's name (see job_seed())
+  Returns:
+    List of the names of the jobs that failed (empty if all went well).
+  """
+  manifest = read_manifest(manifest_path)
+
+  todo = []
+  for name, cql_string, path, transform in jobs:
+    if name in manifest and is_finished(manifest[name]):
+      print('Skipping %s, already done (%d rows)' % (name, manifest[name]['n_rows']))
+    else:
+      todo.append((name, cql_string, corpus, path, transform, max_hits, sample_size, seed))
+
+  if n_workers <= 1 or len(todo) <= 1:
+    results = (_sampling_job(job) for job in todo)
+    pool = None
+  else:
+    pool = ThreadPool(n_workers) if use_threads else Pool(n_workers)
+    results = pool.imap_unordered(_sampling_job, todo)
+
+  failed = []
+  try:
+    for n_done, (name, entry, error) in enumerate(results, 1):
+      if error is None:
+        manifest[name] = entry
+        write_manifest(manifest, manifest_path)
+        print('Done %d/%d: %s (%d rows)' % (n_done, len(todo), name, entry['n_rows']))
+      else:
+        failed.append(name)
+        print('FAILED %d/%d: %s\n%s' % (n_done, len(todo), name, error))
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+
+  return failed
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# Local stand-in for the SeaCOW module, for testing and timing the query layer (seacow_counts.py,
+# seacow_sampling.py, and the scripts that use them) without the SeaCOW server. It has the same Query,
+# Nonprocessor, and ConcordanceLoader classes, but answers queries from a small fixture corpus built from the
+# CSVs in ../7_analysis_samples/: every row is one sentence made up of the derivation (tag NN) and, if there is
+# one, its base (tag base_pos).
+#
+# To use it instead of the real module, put this directory first on the path, e.g.:
+# > PYTHONPATH=seacow_standin python 5_manual_query.py
+# Latency and failures are set with the module-level variables below or with these environment variables:
+#   SEACOW_STANDIN_FIXTURES       directory with the fixture CSVs
+#   SEACOW_STANDIN_LATENCY        seconds every query takes before it returns anything
+#   SEACOW_STANDIN_HIT_LATENCY    additional seconds per match that is passed to a processor
+#   SEACOW_STANDIN_FAILURE_RATE   probability (0-1) that a query raises an error instead of running
+#   SEACOW_STANDIN_LOG            file to which every query is appended as one tab-separated line
+#                                 (pid, start time, duration, hits, error, CQL), also across processes
+#
+# Only single-token queries are understood: '[attr="regex" & attr!="regex" ...]', optionally followed by
+# 'within <s/>', where attr is word, lemma, tag, or compana. Anything else raises a ValueError.
+
+import glob
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lp_index import compile_cql_regex
+
+FIXTURES      = os.environ.get('SEACOW_STANDIN_FIXTURES',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '7_analysis_samples'))
+LATENCY       = float(os.environ.get('SEACOW_STANDIN_LATENCY', 0))
+HIT_LATENCY   = float(os.environ.get('SEACOW_STANDIN_HIT_LATENCY', 0))
+FAILURE_RATE  = float(os.environ.get('SEACOW_STANDIN_FAILURE_RATE', 0))
+LOG           = os.environ.get('SEACOW_STANDIN_LOG')
+ATTRIBUTES    = ['word', 'lemma', 'tag', 'compana']
+
+STATS         = {'queries': 0, 'failures': 0, 'hits': 0}   # Queries run by this process so far.
+
+_corpus       = None
+_lock         = threading.Lock()
+
+
+# ======================================================
+
+
+class SimulatedFailure(Exception):
+  """
+  Raised by Query.run() in place of the errors the server sometimes gives.
+  """
+  pass
+
+
+def load_corpus():
+  """
+  Builds the fixture corpus from the CSVs in FIXTURES (once per process).
+
+  Returns:
+    Tuple of the list of sentences (lists of token dicts with the keys in ATTRIBUTES), the list of their
+    reference dicts (doc.id, doc.url, s.idx), a dict mapping every distinct token (as a tuple of its
+    ATTRIBUTES) to the list of its (sentence, position) occurrences, and a dict mapping every attribute to a dict
+    from its values to the distinct tokens that have them.
+  """
+  global _corpus
+  with _lock:
+    if _corpus is not None:
+      return _corpus
+
+    sentences = []
+    refs = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, '*.csv'))):
+      df = pd.read_csv(path, dtype=str, keep_default_na=False)
+      n = len(df)
+      column = lambda name, default: df[name].tolist() if name in df.columns else [default] * n
+      words, lemmas, companas = column('word', ''), df['lemma'].tolist(), column('compana', '_')
+      bases, base_tags = column('base', ''), column('base_pos', 'NN')
+      doc_ids, doc_urls, s_idcs = column('doc.id', ''), column('doc.url', ''), column('s.idx', '')
+
+      for idx in range(n):
+        tokens = [{'word': words[idx] or lemmas[idx], 'lemma': lemmas[idx], 'tag': 'NN', 'compana': companas[idx] or '_'}]
+        if bases[idx]:
+          tokens.append({'word': bases[idx], 'lemma': bases[idx], 'tag': base_tags[idx] or 'NN', 'compana': '_'})
+        sentences.append(tokens)
+        refs.append({'doc.id': doc_ids[idx], 'doc.url': doc_urls[idx], 's.idx': s_idcs[idx]})
+
+    positions = {}
+    for s_idx, tokens in enumerate(sentences):
+      for t_idx, token in enumerate(tokens):
+        positions.setdefault(tuple(token[attr] for attr in ATTRIBUTES), []).append((s_idx, t_idx))
+
+    by_value = dict((attr, {}) for attr in ATTRIBUTES)
+    for key in positions:
+      for attr, value in zip(ATTRIBUTES, key):
+        by_value[attr].setdefault(value, []).append(key)
+
+    _corpus = (sentences, refs, positions, by_value)
+    return _corpus
+
+
+def _literals(regex):
+  """
+  Returns the list of strings a regex matches if it's only a literal or an alternation of literals (like the
+  queries built by seacow_counts.py), otherwise None.
+  """
+  alternatives = re.split(r'(?<!\\)\|', regex)
+  if not all(re.match(r'^(?:[^.^$*+?()\[\]{}|\\]|\\\W)*$', alt) for alt in alternatives):
+    return None
+  return [re.sub(r'\\(.)', r'\1', alt) for alt in alternatives]
+
+
+def parse_cql(cql):
+  """
+  Splits a single-token CQL query into its conditions.
+
+  Returns:
+    List of (attribute, negated, regex) tuples.
+  """
+  match = re.match(r'^\s*\[(.*)\]\s*(within\s*<s\s*/>)?\s*$', cql)
+  if match is None:
+    raise ValueError('The SeaCOW stand-in cannot run this query: %s' % cql)
+
+  conditions = []
+  for part in re.findall(r'\w+\s*!?=\s*"(?:[^"\\]|\\.)*"|[^&\s][^&]*', match.group(1)):
+    cond = re.match(r'^(\w+)\s*(!?)=\s*"((?:[^"\\]|\\.)*)"\s*$', part)
+    if cond is None or cond.group(1) not in ATTRIBUTES:
+      raise ValueError('The SeaCOW stand-in cannot run this query: %s' % cql)
+    conditions.append((cond.group(1), cond.group(2) == '!', cond.group(3).replace('\\"', '"')))
+  return conditions
+
+
+def find_matches(cql):
+  """
+  Returns the sorted list of (sentence, position) pairs of all tokens matching the query. Conditions that are
+  literals are looked up directly; regexes are matched against the distinct values of their attribute.
+  """
+  conditions = parse_cql(cql)
+  positions, by_value = load_corpus()[2:]
+
+  keys = None
+  for attr, negated, regex in conditions:
+    values = by_value[attr]
+    literals = _literals(regex)
+    if literals is not None:
+      matching = [value for value in literals if value in values]
+    else:
+      pattern = compile_cql_regex(regex)
+      matching = [value for value in values if pattern.match(value)]
+
+    matching_keys = set(key for value in matching for key in values[value])
+    if negated:
+      keys = (set(positions) if keys is None else keys) - matching_keys
+    else:
+      keys = matching_keys if keys is None else keys & matching_keys
+
+  matches = []
+  for key in (keys if keys is not None else positions):
+    matches.extend(positions[key])
+  return sorted(matches)
+
+
+def _log(start, hits, error, cql):
+  """
+  Appends one line about a finished query to LOG (if set).
+  """
+  if LOG:
+    line = '%d\t%.4f\t%.4f\t%d\t%s\t%s\n' % (os.getpid(), start, time.time() - start, hits, error or '',
+                                               cql.replace('\t', ' '))
+    with _lock:
+      with open(LOG, 'ab') as f:
+        f.write(line if isinstance(line, bytes) else line.encode('utf-8'))
+
+
+# ======================================================
+
+
+class Processor(object):
+  """
+  Base class of the processors: run() calls prepare() once, process() for every match, and finalise() once.
+  """
+
+  def prepare(self, query):
+    pass
+
+  def process(self, query, region, meta, match_offset, match_length):
+    pass
+
+  def finalise(self, query):
+    pass
+
+
+class Nonprocessor(Processor):
+  """
+  Does nothing with the matches; use it to get query.hits only.
+  """
+  pass
+
+
+class ConcordanceLoader(Processor):
+  """
+  Collects the matches in self.concordance as dicts with the keys left, match, right (lists of tokens), and meta
+  (dict of the references). Tokens are dicts of the query's attributes if full_structure is True, otherwise their
+  values joined with '|'.
+  """
+
+  def __init__(self):
+    self.full_structure = False
+    self.concordance = []
+
+  def process(self, query, region, meta, match_offset, match_length):
+    def token(tok):
+      if self.full_structure:
+        return dict((attr, tok[attr]) for attr in query.attributes)
+      return '|'.join(tok[attr] for attr in query.attributes)
+
+    self.concordance.append({
+      'left': [token(tok) for tok in region[:match_offset]],
+      'match': [token(tok) for tok in region[match_offset:match_offset+match_length]],
+      'right': [token(tok) for tok in region[match_offset+match_length:]],
+      'meta': meta
+    })
+
+
+class Query(object):
+  """
+  Query on the fixture corpus. Set the same attributes as for a SeaCOW query, then call run(); afterwards,
+  hits contains the total number of matches.
+  """
+
+  def __init__(self):
+    self.corpus          = None
+    self.string          = None
+    self.max_hits        = -1
+    self.attributes      = []
+    self.structures      = []
+    self.references      = []
+    self.container       = None
+    self.processor       = None
+    self.deduplication   = True
+    self.hits            = None
+
+  def set_deduplication(self, off=False):
+    """
+    With deduplication on, matches in a sentence identical to an earlier one (in the same place) are skipped.
+    """
+    self.deduplication = not off
+
+  def run(self):
+    start = time.time()
+    STATS['queries'] += 1
+    time.sleep(LATENCY)
+
+    if FAILURE_RATE and random.random() < FAILURE_RATE:
+      STATS['failures'] += 1
+      _log(start, 0, 'SimulatedFailure', self.string)
+      raise SimulatedFailure('Simulated server failure for %s' % self.string)
+
+    matches = find_matches(self.string)
+    self.hits = len(matches)
+    STATS['hits'] += self.hits
+
+    sentences, refs = load_corpus()[:2]
+    processor = self.processor
+    processor.prepare(self)
+    if not isinstance(processor, Nonprocessor):
+      seen = set()
+      n_passed = 0
+      for s_idx, t_idx in matches:
+        if self.max_hits >= 0 and n_passed >= self.max_hits:
+          break
+        # The fixture sentences only consist of one or two tokens, so include the reference to tell them apart.
+        text = (refs[s_idx]['doc.url'], refs[s_idx]['s.idx']) + tuple(tok['word'] for tok in sentences[s_idx])
+        if self.deduplication and (text, t_idx) in seen:
+          continue
+        seen.add((text, t_idx))
+        meta = dict((ref, refs[s_idx][ref]) for ref in self.references)
+        processor.process(self, sentences[s_idx], meta, t_idx, 1)
+        n_passed += 1
+        if HIT_LATENCY:
+          time.sleep(HIT_LATENCY)
+    processor.finalise(self)
+
+    _log(start, self.hits, None, self.string)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Times the counting and sampling functions against the SeaCOW stand-in in this directory, so that changes to
+# concurrency, caching, or batching can be measured without the server. Nothing outside a temporary directory
+# is written.
+#
+# > python seacow_standin/benchmark.py [LATENCY [FAILURE_RATE]]
+# e.g. 'python seacow_standin/benchmark.py 0.2 0.05' for queries that take 200 ms and fail 5% of the time.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)                       # The stand-in, not the real SeaCOW.
+sys.path.insert(1, os.path.join(HERE, '..'))
+
+import pandas as pd
+
+import SeaCOW
+import seacow_counts as sc
+import seacow_sampling as ss
+from count_cache import CountCache
+
+CORPUS        = 'standin'
+SFXS          = ['-ament', '-ateur', '-ator', '-ismus', '-ist']
+COUNT_FILES   = os.path.join(HERE, '..', '2_backform_samples_nano', '%s_base_freqs.csv')
+QUERIES       = pd.read_csv(os.path.join(HERE, '..', 'queries.csv')).dropna(subset=['query'])
+
+
+# ======================================================
+
+
+def n_logged():
+  """
+  Returns the number of queries in the stand-in's log so far (including those run by worker processes).
+  """
+  if not os.path.exists(SeaCOW.LOG):
+    return 0
+  with open(SeaCOW.LOG, 'rb') as f:
+    return sum(1 for _ in f)
+
+
+def timed(label, fn, *args, **kwargs):
+  """
+  Runs fn(*args, **kwargs) and prints how long it took and how many queries it sent.
+  """
+  n_before = n_logged()
+  start = time.time()
+  try:
+    fn(*args, **kwargs)
+    outcome = 'ok'
+  except Exception as e:
+    outcome = 'failed (%s)' % type(e).__name__
+  print('%-40s %8.2f s %6d queries   %s' % (label, time.time() - start, n_logged() - n_before, outcome))
+
+
+# ======================================================
+
+if __name__ == '__main__':
+  SeaCOW.LATENCY = float(sys.argv[1]) if len(sys.argv) > 1 else 0.02
+  SeaCOW.FAILURE_RATE = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+  tmp_dir = tempfile.mkdtemp()
+  SeaCOW.LOG = os.path.join(tmp_dir, 'queries.log')
+  SeaCOW.load_corpus()      # Before the pools are created, so that the workers inherit the corpus.
+
+  try:
+    cands = pd.concat([pd.read_csv(COUNT_FILES % sfx) for sfx in SFXS])
+    pairs = list(zip(cands['unique_candidates'], cands['pos']))
+    cqls = [sc.lemma_tag_cql(lemma, tag) for lemma, tag in pairs]
+    print('Latency %.3f s, failure rate %.2f, %d lemma/tag pairs (%d unique)\n'
+          % (SeaCOW.LATENCY, SeaCOW.FAILURE_RATE, len(pairs), len(set(pairs))))
+
+    timed('get_counts, 1 worker', sc.get_counts, cqls, CORPUS, n_workers=1, wait=0)
+    timed('get_counts, %d workers' % sc.N_WORKERS, sc.get_counts, cqls, CORPUS, wait=0)
+    timed('get_counts_batched, 1 worker', sc.get_counts_batched, pairs, CORPUS, n_workers=1, wait=0)
+    timed('get_counts_batched, %d workers' % sc.N_WORKERS, sc.get_counts_batched, pairs, CORPUS, wait=0)
+
+    cache = CountCache(os.path.join(tmp_dir, 'count_cache.sqlite'))
+    timed('get_counts_batched, empty cache', sc.get_counts_batched, pairs, CORPUS, wait=0, cache=cache)
+    timed('get_counts_batched, full cache', sc.get_counts_batched, pairs, CORPUS, wait=0, cache=cache)
+    cache.close()
+
+    jobs = [(morph, cql, os.path.join(tmp_dir, morph + '.csv'), None)
+            for morph, cql in zip(QUERIES['morph'], QUERIES['query']) if morph in SFXS]
+    manifest = os.path.join(tmp_dir, 'manifest.csv')
+    timed('run_sampling_jobs, 1 worker', ss.run_sampling_jobs, jobs, CORPUS, manifest, n_workers=1)
+    os.remove(manifest)
+    timed('run_sampling_jobs, %d workers' % ss.N_WORKERS, ss.run_sampling_jobs, jobs, CORPUS, manifest)
+    timed('run_sampling_jobs, rerun', ss.run_sampling_jobs, jobs, CORPUS, manifest)
+  finally:
+    shutil.rmtree(tmp_dir)
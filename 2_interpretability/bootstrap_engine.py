@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+# Bootstrapping of samples as type count vectors, used in gen_bootstrap_samples.ipynb here and in
+# ../4_applicability/. A sample is encoded once as its types and the number of tokens of each type (encode()); a
+# random subsample of it is then drawn directly as a count vector, from a multinomial distribution if it's drawn
+# with replacement and from a multivariate hypergeometric one if not (resample()). Both give the same distribution
+# of frequency distributions as drawing tokens from the sample and counting them, but no token is ever copied:
+# the frequency distribution and the entropy come straight from the counts (freqdist(), sample_entropy()).
+# In nested mode (resample_nested()), the subsamples of all sizes in an iteration are the prefixes of one random
+# sequence of tokens (with replacement) or of one random permutation of the sample (without): each size only adds
+# the tokens between it and the next smaller size to the counts of that one, so the whole ladder of sizes costs
+# as much as drawing the largest subsample once.
+# run_bootstrap() splits the whole grid of samples (e.g. suffixes), iterations, and sizes into tasks and runs them
+# on a pool of processes. Every subsample has its own random generator, seeded from SEED and the name of its
+# sample, its iteration, and its size (SeedSequence), so the results are the same for any number of processes, and
+# any single sample or iteration can be rerun on its own with the same result.
+# FreqdistWriter writes the frequency distributions to disk as they come, partitioned by e.g. suffix and sample
+# size, so that they never all have to be in memory, and so that R can read only the partitions and columns it needs.
+
+import os
+import shutil
+import sys
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy.stats import entropy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1_data', '35_samples'))
+import process_pool
+import sample_store as store
+
+if store.HAVE_PYARROW:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+SEED        = 20210415   # Default seed of run_bootstrap().
+N_PROCESSES = process_pool.N_PROCESSES   # Default number of worker processes of run_bootstrap().
+BUFFER_ROWS = 1000000    # Number of rows that a FreqdistWriter holds before it writes them out.
+_WORKER_JOBS = None   # Jobs of the run_bootstrap() that a worker process belongs to (see _init_worker()).
+
+
+# ======================================================
+
+
+def encode(lemmas, freqs=None):
+    """
+    Encodes a sample as integer type IDs and the number of tokens of each type.
+
+    Args:
+        lemmas: list or Series of the lemma of every token, or of every type if freqs is given
+        freqs: optional list or Series of the frequency of each lemma (e.g. for the RIDGES samples, which are
+            frequency lists); lemmas that occur more than once are summed
+    Returns:
+        Tuple of a numpy array of the types (in order of first appearance) and a numpy int array of their counts.
+    """
+    codes, types = pd.factorize(pd.Series(lemmas))
+    weights = None if freqs is None else np.asarray(freqs, dtype=np.int64)
+    counts = np.bincount(codes, weights=weights, minlength=len(types)).astype(np.int64)
+    return np.asarray(types, dtype=object), counts
+
+
+def resample(counts, size, replace=True, rng=None):
+    """
+    Draws a random subsample of size tokens from a sample given as a count vector.
+
+    Args:
+        counts: numpy int array, number of tokens of each type in the sample (see encode())
+        size: int, number of tokens to draw
+        replace: if True, draw with replacement (multinomial), otherwise without (multivariate hypergeometric, so
+            size can't be larger than the sample)
+        rng: numpy Generator (default: a new one with a random seed)
+    Returns:
+        numpy int array with the number of tokens of each type in the subsample (0 for types not drawn).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if replace:
+        return rng.multinomial(size, counts / float(counts.sum()))
+    return rng.multivariate_hypergeometric(counts, size)
+
+
+def resample_nested(counts, sizes, replace=True, rng=None):
+    """
+    Draws nested random subsamples of every size in sizes from a sample given as a count vector: each subsample
+    is the prefix of the same random sequence of tokens drawn from the sample (with replacement) or of the same
+    random permutation of it (without). Going up from the smallest size, the tokens between two sizes are drawn as
+    one count vector and added to the counts of the smaller one; without replacement, they are drawn from the
+    tokens that are left.
+
+    Args:
+        counts: numpy int array, number of tokens of each type in the sample (see encode())
+        sizes: list of ints, sizes of the subsamples (in any order)
+        replace: if True, draw with replacement, otherwise without (so no size can be larger than the sample)
+        rng: numpy Generator (default: a new one with a random seed)
+    Returns:
+        List of numpy int arrays, the count vectors of the subsamples in the order of sizes.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    nested = [None] * len(sizes)
+    curr_counts = np.zeros_like(counts)
+    curr_size = 0
+    for size_idx in np.argsort(sizes, kind='mergesort'):
+        step = sizes[size_idx] - curr_size
+        if step > 0:
+            curr_counts = curr_counts + resample(counts if replace else counts - curr_counts, step, replace, rng)
+            curr_size = sizes[size_idx]
+        nested[size_idx] = curr_counts
+    return nested
+
+
+def freqdist(types, counts):
+    """
+    Turns a count vector into a frequency distribution.
+
+    Args:
+        types: numpy array of the types (see encode())
+        counts: numpy int array, number of tokens of each type
+    Returns:
+        pandas df with the columns type, n_tokens, and rank, one row per type that occurs, the most frequent first
+        (types with the same number of tokens in order of their IDs).
+    """
+    ids = np.flatnonzero(counts)
+    ids = ids[np.argsort(-counts[ids], kind='mergesort')]
+    return pd.DataFrame({'type': types[ids], 'n_tokens': counts[ids], 'rank': np.arange(1, len(ids)+1)},
+                        columns=['type', 'n_tokens', 'rank'])
+
+
+def sample_entropy(counts, base=2):
+    """
+    Computes the entropy of the frequency distribution of a count vector (types that don't occur are ignored).
+
+    Returns:
+        Tuple of the entropy (in bits for base 2) and the number of types that occur.
+    """
+    counts = counts[counts > 0]
+    return entropy(counts, base=base), len(counts)
+
+
+# ======================================================
+
+
+def task_rng(seed, key, iter_idx, size_idx=None):
+    """
+    Random generator of one task of run_bootstrap(), derived from seed and the position of the task in the grid of
+    samples, iterations, and sizes (size_idx is None for a nested task, which draws all sizes at once).
+
+    Args:
+        seed: int
+        key: name of the sample, e.g. '-ung' (anything with a stable repr())
+        iter_idx: iteration
+        size_idx: index of the size, or None
+    Returns:
+        numpy Generator.
+    """
+    spawn_key = (zlib.crc32(repr(key).encode('utf-8')), iter_idx)
+    if size_idx is not None:
+        spawn_key += (size_idx + 1,)
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+
+
+def _run_task(jobs, task):
+    """
+    Draws the subsamples of one task of run_bootstrap() and computes their frequency distributions.
+
+    Args:
+        jobs: list of the jobs of run_bootstrap()
+        task: tuple of the index of the job in jobs, the iteration, the index of the size (None for all sizes
+            at once in nested mode), whether to draw with replacement, and the seed
+    Returns:
+        List of tuples of the key of the job, the iteration, the index of the size, and the freqdist df.
+    """
+    job_idx, iter_idx, size_idx, replace, seed = task
+    key, types, counts, sizes = jobs[job_idx]
+    rng = task_rng(seed, key, iter_idx, size_idx)
+    if size_idx is None:
+        samples = enumerate(resample_nested(counts, sizes, replace, rng))
+    else:
+        samples = [(size_idx, resample(counts, sizes[size_idx], replace, rng))]
+    return [(key, iter_idx, curr_idx, freqdist(types, curr_counts)) for curr_idx, curr_counts in samples]
+
+
+def _init_worker(jobs):
+    """
+    Hands the jobs of a run_bootstrap() to a worker process of its pool when the worker starts, so that the
+    tasks only have to carry the index of their job.
+    """
+    global _WORKER_JOBS
+    _WORKER_JOBS = jobs
+
+
+def _run_worker_task(task):
+    """
+    _run_task() on the jobs of the pool that this worker process belongs to.
+    """
+    return _run_task(_WORKER_JOBS, task)
+
+
+def run_bootstrap(jobs, n_iter, replace=True, nested=False, seed=SEED, n_workers=N_PROCESSES):
+    """
+    Generator of the frequency distributions of n_iter random subsamples of every size of every sample in jobs.
+    Every subsample (or, in nested mode, every iteration of a sample) is one task with its own random generator
+    (see task_rng()); the tasks run on n_workers forked processes (see process_pool.py), and the results come back
+    in the order of the jobs, then iterations, then sizes, the same for any n_workers.
+
+    Args:
+        jobs: list of tuples of the key of a sample (e.g. the suffix), its types and counts (see encode()), and the
+            list of sizes of its subsamples
+        n_iter: number of iterations
+        replace: if True, draw with replacement, otherwise without
+        nested: if True, the subsamples of one iteration are prefixes of each other (see resample_nested())
+        seed: int
+        n_workers: number of processes (1 runs the tasks one after another in this process)
+    Yields:
+        Tuples of the key of the sample, the iteration (starting with 1), the index of the size, and the freqdist
+        df of the subsample (see freqdist()).
+    """
+    jobs = list(jobs)
+    tasks = [(job_idx, iter_idx, size_idx, replace, seed)
+             for job_idx, (_, _, _, sizes) in enumerate(jobs)
+             for iter_idx in range(1, n_iter+1)
+             for size_idx in ([None] if nested else range(len(sizes)))]
+
+    if n_workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            for result in _run_task(jobs, task):
+                yield result
+        return
+
+    # Every run has its own pool, whose workers get its jobs when they start (so two runs can't mix them up).
+    # imap() returns the results in input order; a few tasks per chunk save round trips to the workers.
+    pool = process_pool.fork_pool(min(n_workers, len(tasks)), _init_worker, (jobs,))
+    try:
+        for results in pool.imap(_run_worker_task, tasks, chunksize=max(1, len(tasks) // (n_workers * 16))):
+            for result in results:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# ======================================================
+
+
+class FreqdistWriter(object):
+    """
+    Writes frequency distributions (e.g. from run_bootstrap()) to a directory as they come, one file per partition,
+    e.g. iterdata/freqdist_iter_500_wrepl/suffix=heit/sample_size=10/part-0.parquet. The partition columns are only
+    stored in the directory names (the layout that open_dataset() of the R package arrow reads), the other integer
+    columns as int32, and all columns dictionary-encoded and compressed (see sample_store.PARQUET_OPTIONS). Rows
+    are held back until there are buffer_rows of them, and every file is written in order of the rows. Without
+    pyarrow, the files are CSV.
+
+    A directory that isn't empty is only written to with overwrite=True, which deletes its old contents first. Use
+    the writer in a with statement, or call close() at the end.
+    """
+
+    def __init__(self, path, partition_cols, buffer_rows=BUFFER_ROWS, overwrite=False):
+        if os.path.isdir(path) and os.listdir(path):
+            if not overwrite:
+                raise ValueError('%s is not empty; pass overwrite=True to replace its contents' % path)
+            shutil.rmtree(path)
+        self.path = path
+        self.partition_cols = list(partition_cols)
+        self.buffer_rows = buffer_rows
+        self.n_rows = 0
+        self._buffers = OrderedDict()   # Partition values -> list of dfs not written yet.
+        self._n_buffered = 0
+        self._files = {}                # Partition values -> ParquetWriter (or path of the CSV file).
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, df):
+        """
+        Adds the rows of df, which must have all partition columns, to their partitions.
+        """
+        for values, part_df in df.groupby(self.partition_cols, sort=False):
+            values = values if isinstance(values, tuple) else (values,)
+            self._buffers.setdefault(values, []).append(part_df.drop(columns=self.partition_cols))
+        self._n_buffered += len(df)
+        if self._n_buffered >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes out all rows held back so far.
+        """
+        for values, dfs in self._buffers.items():
+            df = pd.concat(dfs, ignore_index=True)
+            int_cols = df.select_dtypes('integer').columns
+            df[int_cols] = df[int_cols].astype(np.int32)
+            self._write_part(values, df)
+            self.n_rows += len(df)
+        self._buffers = OrderedDict()
+        self._n_buffered = 0
+
+    def close(self):
+        """
+        Writes out the rest of the rows and closes all files.
+        """
+        self.flush()
+        for part_file in self._files.values():
+            if not isinstance(part_file, str):
+                part_file.close()
+        self._files = {}
+
+    def _write_part(self, values, df):
+        if values not in self._files:
+            part_dir = os.path.join(self.path, *['%s=%s' % item for item in zip(self.partition_cols, values)])
+            os.makedirs(part_dir)
+            if store.HAVE_PYARROW:
+                self._files[values] = pq.ParquetWriter(os.path.join(part_dir, 'part-0.parquet'),
+                                                       pa.Schema.from_pandas(df, preserve_index=False),
+                                                       **store.PARQUET_OPTIONS)
+            else:
+                self._files[values] = os.path.join(part_dir, 'part-0.csv')
+                df.to_csv(self._files[values], index=False, encoding='UTF-8')
+                return
+        if store.HAVE_PYARROW:
+            self._files[values].write_table(pa.Table.from_pandas(df, preserve_index=False))
+        else:
+            df.to_csv(self._files[values], mode='a', header=False, index=False, encoding='UTF-8')
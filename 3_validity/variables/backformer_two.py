@@ -2,33 +2,21 @@
 # 09.06.2021
 # To be used in Python 3.
 
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '1_data', '35_samples'))
+import backformer_engine as engine
+
+
+# The cleanup of the samples is the same in both versions (see backformer_engine.py).
+prep_sfx_lemmas = engine.prep_sfx_lemmas
+prep_sfx_df = engine.prep_sfx_df
+
 
-def prep_sfx_df(df_raw):
-    """
-    If there are compounds in the data, then replace the value of 'lemma' with the compound head, in 'cpd.N2'.
-    If lemma contains -, split at - and take final element (also the head).
-    Drop any rows where the lemma contains |; this is a case of ambiguous lemmatisation.
-    
-    Arg:
-        df_raw: pandas df containing lemma, compana, cpd.N1, cpd.N2 columns, straight out of SeaCOW
-    Returns:
-        df with cpd.N2 integrated into lemma and cols compana and cpd.N1 dropped.
-    """
-    df_in = df_raw.copy()
-    df_in['lemma'] = pd.np.where(df_raw['cpd.N2'].isnull(),
-                      df_raw['lemma'],
-                      df_raw['cpd.N2'])
-    df_in['lemma'] = pd.np.where(df_in.lemma.str.contains('-'),
-                                df_in.lemma.str.split('-').str[-1],
-                                df_in.lemma)
-    df_in.drop(['compana', 'cpd.N1', 'cpd.N2'], axis=1, inplace=True)
-    df_in = df_in[~df_in['lemma'].str.contains('|', regex=False)].reset_index(drop=True)
-    
-    return df_in
-    
-    
 def prep_pfx_df(df_raw):
     """
     If there are compounds in the data, then replace the value of 'lemma' with the compound N1, in 'cpd.N1'.
@@ -40,7 +28,7 @@ def prep_pfx_df(df_raw):
         df with cpd.N1 integrated into lemma and cols compana and cpd.N1 dropped.
     """
     df_in = df_raw.copy()
-    df_in['lemma'] = pd.np.where(df_raw['cpd.N1'].isna(),
+    df_in['lemma'] = np.where(df_raw['cpd.N1'].isna(),
                       df_raw['lemma'],
                       df_raw['cpd.N1'])
     df_in.drop(columns=['compana', 'cpd.N1', 'cpd.N2'], inplace=True)
@@ -939,14 +927,20 @@ def get_unique_base_cands(df):
     Identifies the unique bases from a df containing potential base candidates. Returns them, along with their POS, in a new df.
 
     Arg:
-        df: pandas df, output of get_X_bases()
+        df: pandas df, output of get_X_bases(), get_bases() (also with tokens=False), or get_base_cands()
     Returns:
         Pandas df with three columns: lemma, unique_candidates, and pos.
     """
 
+    # The output of get_base_cands() already is in long format and only contains real candidates.
+    if 'rule_id' in df.columns:
+        cands = df[['lemma', 'candidate', 'pos']].rename(columns={'candidate': 'unique_candidates'})
+        return cands.drop_duplicates(subset=['unique_candidates', 'pos']).reset_index(drop=True)
+
     # Convert the dataframe into a format that will make deduplication easier while maintaining lemma-base mapping.
-    cands = pd.melt(df.drop(['morph', 'doc.id', 'doc.url', 's.idx', 'word'], axis=1),
+    cands = pd.melt(df,
                     id_vars = 'lemma',
+                    value_vars = [col for col in df.columns if col.startswith('base_cand')],
                     var_name = 'base_type',
                     value_name = 'unique_candidates')
 
@@ -993,122 +987,221 @@ def get_cql_from_bases(bases_df):
     return cql_list
 
 
-def get_bases(df_raw, sfx):
-    """
-    Frontend function that calls the get_X_bases() method of whatever suffix is passed in and returns
-    whatever was returned.
-
-    Arg:
-        df_raw: dataframe containing derivations in column 'lemma', read in from file.
-        sfx: string representing the suffix (must be in predetermined list of suffixes)
-    Returns:
-        pandas df containing original data along with the generated bases for the given data and sfx.
-    """
-    IEREN_SFXS = {'-ament', '-ateur', '-ator', '-age', '-and', '-ant', '-anz', '-ation', '-atur', '-ement', '-end', '-ent', '-enz', '-eur', '-iment', '-iteur', '-itur'}
-    INDIV_SFXS = { '-e', '-el', '-er', '-heit', '-ie', '-ik', '-iker', '-ikum', '-ismus', '-ist', '-itaet', '-ition', '-ium', '-ling', '-nis', '-schaft', '-ung'}
-    
-    # Check that input suffix is valid.
-    if sfx not in set.union(IEREN_SFXS, INDIV_SFXS):
-        raise ValueError('Invalid suffix, please enter one of the following forms: %s' % str(set.union(IEREN_SFXS, INDIV_SFXS)))
-        
-    # Clean up the data using prep_sfx_df().
-    df = prep_sfx_df(df_raw)
-    	
-    if sfx in IEREN_SFXS:
-        bases = get_bases_w_ieren(df, sfx)
-    elif sfx == '-e':
-        bases = get_e_bases(df)
-    elif sfx == '-el':
-        bases = get_el_bases(df)
-    elif sfx == '-er':
-        bases = get_er_bases(df)
-    elif sfx == '-heit':
-        bases = get_heit_bases(df)
-    elif sfx == '-ie':
-        bases = get_ie_bases(df)
-    elif sfx == '-ik':
-        bases = get_ik_bases(df)
-    elif sfx == '-iker':
-        bases = get_iker_bases(df)
-    elif sfx == '-ikum':
-        bases = get_ikum_bases(df)
-    elif sfx == '-ismus':
-        bases = get_ismus_bases(df)
-    elif sfx == '-ist':
-        bases = get_ist_bases(df)
-    elif sfx == '-itaet':
-        bases = get_itaet_bases(df)
-    elif sfx == '-ition':
-        bases = get_ition_bases(df)
-    elif sfx == '-ium':
-        bases = get_ium_bases(df)
-    elif sfx == '-ling':
-        bases = get_ling_bases(df)
-    elif sfx == '-nis':
-        bases = get_nis_bases(df)
-    elif sfx == '-schaft':
-        bases = get_schaft_bases(df)
-    elif sfx == '-ung':
-        bases = get_ung_bases(df)
-
-    return bases
-	
-
-def get_bases_no_cleanup(df, sfx):
-    """
-    Frontend function that calls the get_X_bases() method of whatever suffix is passed in and returns
-    whatever was returned.
-	Same as get_bases(), but doesn't call the cleanup function for the raw corpus data (will be used for 
-	the semantic relatedness scores from DErivBase).
-
-    Arg:
-        df: dataframe containing derivations in column 'lemma'.
-        sfx: string representing the suffix (must be in predetermined list of suffixes)
-    Returns:
-        pandas df containing original data along with the generated bases for the given data and sfx.
-    """
-    IEREN_SFXS = {'-ament', '-ateur', '-ator', '-age', '-and', '-ant', '-anz', '-ation', '-atur', '-ement', '-end', '-ent', '-enz', '-eur', '-iment', '-iteur', '-itur'}
-    INDIV_SFXS = { '-e', '-el', '-er', '-heit', '-ie', '-ik', '-iker', '-ikum', '-ismus', '-ist', '-itaet', '-ition', '-ium', '-ling', '-nis', '-schaft', '-ung'}
-    
-    # Check that input suffix is valid.
-    if sfx not in set.union(IEREN_SFXS, INDIV_SFXS):
-        raise ValueError('Invalid suffix: '+sfx+'. Please enter one of the following forms: %s' % str(set.union(IEREN_SFXS, INDIV_SFXS)))
-    	
-    if sfx in IEREN_SFXS:
-        bases = get_bases_w_ieren(df, sfx)
-    elif sfx == '-e':
-        bases = get_e_bases(df)
-    elif sfx == '-el':
-        bases = get_el_bases(df)
-    elif sfx == '-er':
-        bases = get_er_bases(df)
-    elif sfx == '-heit':
-        bases = get_heit_bases(df)
-    elif sfx == '-ie':
-        bases = get_ie_bases(df)
-    elif sfx == '-ik':
-        bases = get_ik_bases(df)
-    elif sfx == '-iker':
-        bases = get_iker_bases(df)
-    elif sfx == '-ikum':
-        bases = get_ikum_bases(df)
-    elif sfx == '-ismus':
-        bases = get_ismus_bases(df)
-    elif sfx == '-ist':
-        bases = get_ist_bases(df)
-    elif sfx == '-itaet':
-        bases = get_itaet_bases(df)
-    elif sfx == '-ition':
-        bases = get_ition_bases(df)
-    elif sfx == '-ium':
-        bases = get_ium_bases(df)
-    elif sfx == '-ling':
-        bases = get_ling_bases(df)
-    elif sfx == '-nis':
-        bases = get_nis_bases(df)
-    elif sfx == '-schaft':
-        bases = get_schaft_bases(df)
-    elif sfx == '-ung':
-        bases = get_ung_bases(df)
-
-    return bases
\ No newline at end of file
+# ======================================================
+# Rule sets for backformer_engine.py, which generates the same candidates as the get_X_bases() functions above
+# (same columns in the same order, quirks included) for all lemmas at once. Keyed by the function names in
+# column fn_backformer_two of queries.csv.
+
+def _lower_stem(n):
+    return ('stem', 'lemma', [('strip', n), ('lower',)])
+
+
+_NOUML = ('nouml', 'stem', [('nouml',)])
+
+RULE_SETS = {
+    'ament_ateur': {
+        'vars': [_lower_stem(5)],
+        'cands': [('base_cand1_VVINF', 'stem', [('add', 'ieren')], []),
+                  ('base_cand2_VVINF', 'stem', [('strip', 1), ('add', 'zieren')], [('stem', 'endswith', 'k')])],
+    },
+    'ator': {
+        'vars': [_lower_stem(4)],
+        'when': [('stem', 'longer', 0)],  # Sometimes we get lemma = "Tor", ignore
+        'cands': [('base_cand1_VVINF', 'stem', [('add', 'ieren')], []),
+                  ('base_cand2_VVINF', 'stem', [('strip', 1), ('add', 'zieren')], [('stem', 'endswith', 'k')])],
+    },
+    'e': {
+        'vars': [_lower_stem(1), _NOUML,
+                 ('stem', 'stem', [('irreg', [('gab', 'geb'), ('sprach', 'sprech'), ('nahm', 'nehm'), ('hilf', 'helf'),
+                                              ('insass', 'sitz'), ('mühl', 'mahl'), ('rach', 'räch'),
+                                              ('stieg', 'steig')])])],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'nouml', [], [('stem', 'has_umlaut')]),
+                  ('base_cand3_VVINF', 'stem', [('add', 'en')], [])],
+    },
+    'el': {
+        'vars': [_lower_stem(2), _NOUML,
+                 ('low', 'lemma', [('lower',)]),
+                 ('low_nouml', 'lemma', [('lowercase',), ('nouml',), ('fix_umlauts',)])],
+        'cands': [('base_cand1_NN', 'stem', [('cap',)], []),
+                  ('base_cand2_NN', 'nouml', [('cap',)], [('stem', 'has_umlaut')]),
+                  ('base_cand3_VVINF', 'stem', [('add', 'en')], []),
+                  ('base_cand4_VVINF', 'nouml', [('add', 'en')], [('stem', 'has_umlaut')]),
+                  ('base_cand5_VVINF', 'low', [('add', 'n')], []),
+                  ('base_cand6_VVINF', 'low_nouml', [('add', 'n')], [('stem', 'has_umlaut')])],
+    },
+    'er': {
+        'vars': [_lower_stem(2), _NOUML,
+                 ('stem', 'stem', [('irreg', [('satz', 'setz'), ('säng', 'sing'), ('gäng', 'geh')])])],
+        'when': [('stem', 'longer', 1)],
+        'cands': [('base_cand1_VVINF', 'stem', [('add', 'en')], []),
+                  ('base_cand2_VVINF', 'nouml', [('add', 'en')], [('stem', 'has_umlaut')]),
+                  ('base_cand3_VVINF', 'stem', [('add', 'n')], [('stem', 'endswith', 'r')]),
+                  ('base_cand4_VVINF', 'stem', [('strip', 1), ('add', 'eln')], [('stem', 'endswith', 'l')]),
+                  ('base_cand5_VVINF', 'nouml', [('strip', 1), ('add', 'eln')],
+                   [('stem', 'endswith', 'l'), ('stem', 'has_umlaut')]),
+                  ('base_cand6_VVINF', 'stem', [('add', 'n')], [('stem', 'endswith', 'tu')]),
+                  ('base_cand7_VVINF', 'stem', [('strip', 1), ('add', 'en')], [('stem', 'endswith', 'l')]),
+                  ('base_cand8_VVINF', 'stem', [('strip', 1), ('add', 'en')], [('stem', 'endswith', 'n')]),  # Schuldner - schuld
+                  ('base_cand1_NN', 'stem', [('strip', 1), ('cap',)], [('stem', 'endswith', 'l')]),
+                  ('base_cand2_NN', 'nouml', [('strip', 1), ('cap',)], [('stem', 'endswith', 'l'), ('stem', 'has_umlaut')]),
+                  ('base_cand3_NN', 'stem', [('cap',)], []),
+                  ('base_cand4_NN', 'nouml', [('cap',)], [('stem', 'has_umlaut')]),
+                  ('base_cand5_NN', 'nouml', [('strip', 1), ('cap',), ('add', 'en')], [('nouml', 'endswith', 'n')]),  # Gärtner-Garten
+                  ('base_cand6_NN', 'stem', [('strip', 1), ('cap',), ('add', 'er')], [('stem', 'endswith', 'r')]),  # Abenteurer-Abenteuer
+                  ('base_cand7_NN', 'nouml', [('cap',), ('add', 'e')], []),  # Schüler-Schule
+                  ('base_cand8_NN', 'stem', [('strip', 2), ('cap',)], [('stem', 'endswith', 'an')]),  # Lutheraner-Luther
+                  ('base_cand9_NN', 'stem', [('strip', 2), ('cap',), ('add', 'a')], [('stem', 'endswith', 'an')]),  # Amerikaner-Amerika
+                  ('base_cand10_NN', 'stem', [('strip', 2), ('cap',), ('add', 'en')], [('stem', 'endswith', 'an')]),  # Sizilianer-Sizilien
+                  ('base_cand11_NN', 'stem', [('cap',), ('add', 'e')], []),
+                  ('base_cand12_NN', 'stem', [('strip', 1), ('cap',), ('add', 'e')], [('stem', 'endswith', 'l')]),  # Sprachler-Sprache
+                  ('base_cand13_NN', 'stem', [('strip', 1), ('cap',), ('add', 'e')], [('stem', 'endswith', 'n')]),  # Rentner-Rente
+                  ('base_cand14_NN', 'nouml', [('strip', 1), ('cap',)], [('nouml', 'endswith', 'n')]),  # Söldner-Sold, Zöllner-Zoll
+                  ('base_cand15_NN', 'nouml', [('strip', 1), ('cap',), ('add', 'e')], [('nouml', 'endswith', 'n')])],  # Glöckner-Glocke
+    },
+    'heit': {
+        'vars': [('stem', 'lemma', [('strip', 4), ('lower',), ('strip_if_endswith', 'losig', 2)]), _NOUML,
+                 ('stem', 'stem', [('irreg_whole', [('ho', 'hoch')])]),
+                 ('umlo', 'stem', [('replace', 'o', 'ö')])],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'stem', [('strip', 2)], [('stem', 'endswith', 'ig')]),
+                  ('base_cand3_ADJ.', 'stem', [('add', 'd')], [('stem', 'endswith', 'en')]),
+                  ('base_cand4_ADJ.', 'stem', [('add', 'e')], [('lemma', 'char', (-4, 'h')), ('stem', 'not_endswith', 'los')]),
+                  ('base_cand5_ADJ.', 'umlo', [], [('stem', 'contains', 'o'), ('stem', 'not_endswith', 'los')]),
+                  ('base_cand6_ADJ.', 'umlo', [('add', 'e')], [('stem', 'contains', 'o'), ('stem', 'not_endswith', 'los')]),
+                  ('base_cand7_ADJ.', 'stem', [('add', 't')], [('stem', 'not_endswith', 'los')]),
+                  ('base_cand8_ADJ.', 'umlo', [('add', 't')], [('stem', 'contains', 'o'), ('stem', 'not_endswith', 'los')]),
+                  ('base_cand9_ADJ.', 'nouml', [], [('stem', 'has_umlaut')]),
+                  ('base_cand10_ADJ.', 'nouml', [('strip', 2)], [('stem', 'endswith', 'ig')])],
+    },
+    'ie': {
+        'vars': [_lower_stem(2)],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'stem', [('add', 'isch')], [])],
+    },
+    'ik': {
+        'vars': [_lower_stem(2)],
+        'cands': [('base_cand1_ADJ.', 'stem', [('add', 'isch')], [])],
+    },
+    'iker': {
+        'vars': [_lower_stem(4)],
+        'cands': [('base_cand1_ADJ.', 'stem', [('add', 'isch')], [])],
+    },
+    'ikum': {
+        'vars': [_lower_stem(4)],
+        'cands': [('base_cand1_ADJ.', 'stem', [('add', 'isch')], [])],
+    },
+    'ismus': {
+        'vars': [('raw', 'lemma', [('strip', 5)]), ('stem', 'raw', [('lower',)])],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'stem', [('strip', 2), ('add', 'ell')], [('stem', 'endswith', 'al')]),
+                  ('base_cand3_ADJ.', 'stem', [('strip', 2), ('add', 'är')], [('stem', 'endswith', 'ar')]),
+                  ('base_cand4_ADJ.', 'stem', [('add', 'isch')], []),
+                  ('base_cand5_ADJ.', 'stem', [('strip', 2), ('add', 'isch')], [('stem', 'endswith', 'iz')]),
+                  ('base_cand6_ADJ.', 'stem', [('add', 'istisch')], []),
+                  ('base_cand1_NN', 'raw', [], []),
+                  ('base_cand2_NN', 'raw', [('add', 'ik')], [('raw', 'not_endswith', 'z')], [('strip', 2), ('add', 'ik')]),
+                  ('base_cand3_NN', 'raw', [('add', 'istik')], [])],
+    },
+    'ist': {
+        'vars': [('full', 'lemma', [('lower',)]), _lower_stem(3), ('noun', 'stem', [('cap',)])],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'stem', [('add', 'isch')], []),
+                  ('base_cand3_ADJ.', 'full', [('add', 'isch')], []),
+                  ('base_cand4_VVINF', 'stem', [('add', 'ieren')], []),
+                  ('base_cand5_NN', 'noun', [('map', {'Poliz':'Polizei', 'Pian':'Piano'})], []),
+                  ('base_cand6_NN', 'noun', [], []),
+                  ('base_cand7_NN', 'noun', [('add', 'ie')], []),
+                  ('base_cand8_NN', 'noun', [('add', 'e')], []),
+                  ('base_cand9_NN', 'noun', [('strip', 2)], [('noun', 'endswith', 'al')]),
+                  ('base_cand10_NN', 'noun', [('add', 'a')], []),
+                  ('base_cand11_NN', 'noun', [('add', 'ismus')], [])],
+    },
+    'ität': {
+        'vars': [_lower_stem(4)],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'stem', [('strip', 2), ('add', 'ell')], [('stem', 'endswith', 'al')]),
+                  ('base_cand3_ADJ.', 'stem', [('strip', 3), ('add', 'bel')], [('stem', 'endswith', 'bil')]),
+                  ('base_cand4_ADJ.', 'stem', [('strip', 2), ('add', 'isch')], []),
+                  ('base_cand5_ADJ.', 'stem', [('add', 'isch')], []),
+                  ('base_cand6_ADJ.', 'stem', [('strip', 1)], [('stem', 'endswith', ('a', 'e', 'i', 'o', 'u'))]),
+                  ('base_cand7_ADJ.', 'stem', [('strip', 1), ('add', 'k')], [('stem', 'endswith', 'z')]),
+                  ('base_cand8_ADJ.', 'stem', [('strip', 2), ('add', 'ös')], [('stem', 'endswith', 'os')]),
+                  ('base_cand9_ADJ.', 'stem', [('strip', 2), ('add', 'är')], [('stem', 'endswith', 'ar')])],
+    },
+    'ition': {
+        'vars': [_lower_stem(5)],
+        'cands': [('base_cand1_VVINF', 'stem', [('add', 'ieren')], []),
+                  ('base_cand2_VVINF', 'stem', [('strip', 1), ('add', 'nieren')], [('stem', 'endswith', 's')])],
+    },
+    'ium': {
+        'vars': [_lower_stem(3), ('raw', 'lemma', [('strip', 3)])],
+        'cands': [('base_cand1_VVINF', 'stem', [('add', 'ieren')], []),
+                  ('base_cand2_NN', 'raw', [], [])],
+    },
+    'ling': {
+        'vars': [('raw', 'lemma', [('strip', 4)]), ('stem', 'raw', [('lower',)]), _NOUML],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'nouml', [], [('stem', 'has_umlaut')]),
+                  ('base_cand3_ADJ.', 'stem', [('add', 'e')], [('stem', 'isin', {'feig', 'träg', 'weis'})]),
+                  ('base_cand4_VVINF', 'stem', [('add', 'en')], []),
+                  ('base_cand5_VVINF', 'stem', [('add', 'n')], [('stem', 'endswith', ('r', 'l'))]),
+                  ('base_cand6_VVINF', 'nouml', [('add', 'en')], [('stem', 'has_umlaut')]),
+                  ('base_cand7_VVINF', 'stem', [('replace', 'ss', 'ß'), ('replace', 'ö', 'ie'), ('add', 'en')],
+                   [('stem', 'contains', 'ö')]),
+                  ('base_cand8_NN', 'raw', [], []),
+                  ('base_cand9_NN', 'raw', [('add', 'en')], [])],
+    },
+    'nis': {
+        'exclude': {'Tennis', 'Anis', 'Penis', 'Dennis'},
+        'vars': [('stem', 'lemma', [('strip', 3), ('lower',), ('after_hyphen',), ('replace', 'ä', 'a'),
+                                    ('irreg', [('kennt', 'kenn'), ('gedacht', 'gedenk'), ('arger', 'ärger'),
+                                               ('bedrang', 'bedräng'), ('stand', 'steh'), ('verhang', 'verhäng'),
+                                               ('versaum', 'versäum')])])],
+        'cands': [('base_cand1_ADJ.', 'stem', [], []),
+                  ('base_cand2_ADJ.', 'stem', [('add', 'en')], [('stem', 'startswith', 'ge')]),
+                  ('base_cand3_VVINF', 'stem', [('add', 'n')], [('stem', 'endswith', 'er')]),
+                  ('base_cand4_VVINF', 'stem', [('add', 'en')], []),
+                  ('base_cand5_VVINF', 'stem', [('add', 'nen')], [('stem', 'endswith', ('g', 'ch'))])],
+    },
+    'schaft': {
+        'vars': [('raw', 'lemma', [('strip', 6), ('irreg', [('Brüder', 'Bruder')])]),
+                 ('low', 'raw', [('lower',)])],
+        'cands': [('base_cand1_NN', 'raw', [], []),
+                  ('base_cand2_NN', 'raw', [('add', 'e')], []),
+                  ('base_cand3_ADJ.', 'low', [], []),
+                  ('base_cand4_VVINF', 'low', [('add', 'en')], []),
+                  ('base_cand5_VVINF', 'low', [('add', 'n')], [('low', 'endswith', 'r')]),
+                  ('base_cand6_NN', 'raw', [('strip', 1)], [('raw', 'endswith', 'n')]),
+                  # get_schaft_bases() assigns base_cand7_NN twice, so only the second one is kept.
+                  ('base_cand7_NN', 'raw', [('strip', 2)], [('raw', 'endswith', 'en')]),
+                  ('base_cand7_NN', 'raw', [('strip', 2)], [('raw', 'endswith', 'er')])],
+    },
+    'ung': {
+        'vars': [_lower_stem(3)],
+        'cands': [('base_cand1_VVINF', 'stem', [('add', 'en')], []),
+                  ('base_cand2_VVINF', 'stem', [('add', 'n')], [('stem', 'endswith', ('er', 'el')), ('stem', 'not_char', (-3, 'i'))]),
+                  ('base_cand3_VVINF', 'stem', [('strip', 1), ('add', 'eln')], [('stem', 'endswith', 'l'), ('stem', 'not_endswith', 'll')])],
+    },
+    'w_ieren': {
+        'vars': [('stem', 'lemma', [('strip_sfx',), ('lower',)])],
+        'when': [('stem', 'longer', 0)],
+        'cands': [('base_cand1_VVINF', 'stem', [('add', 'ieren')], []),
+                  ('base_cand2_VVINF', 'stem', [('strip', 1), ('add', 'zieren')], [('stem', 'endswith', 'k')])],
+    },
+}
+
+# The frontend (get_bases() etc.) is the same in both versions: that of backformer_engine.Backformer, with the rule
+# sets above and, as the reference to check them against, the get_X_bases() functions.
+BACKFORMER = engine.Backformer(RULE_SETS, 'fn_backformer_two', globals())
+DISPATCH = BACKFORMER.dispatch
+SFX_RULE_SETS = BACKFORMER.sfx_rule_sets
+
+get_bases = BACKFORMER.get_bases
+get_base_cands = BACKFORMER.get_base_cands
+get_base_cands_routed = BACKFORMER.get_base_cands_routed
+get_bases_no_cleanup = BACKFORMER.get_bases_no_cleanup
+match_bases = BACKFORMER.match_bases
+match_bases_chunked = BACKFORMER.match_bases_chunked
+get_bases_legacy = BACKFORMER.get_bases_legacy
+check_engine = BACKFORMER.check_engine